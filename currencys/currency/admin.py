@@ -11,3 +11,9 @@ class CurrencyInfoAdmin(admin.ModelAdmin):
 @admin.register(models.CurrencyRate)
 class CurrencyRateAdmin(admin.ModelAdmin):
     date_hierarchy = 'date'
+
+
+@admin.register(models.BackfillTask)
+class BackfillTaskAdmin(admin.ModelAdmin):
+    list_display = ('currencyInfo', 'date_from', 'date_to', 'status', 'attempts')
+    list_filter = ('status', )
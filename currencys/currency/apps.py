@@ -1,4 +1,12 @@
+from typing import TYPE_CHECKING
+
 from django.apps import AppConfig
+from django.conf import settings
+
+from . import markers
+
+if TYPE_CHECKING:
+    from .parser import Updater
 
 __all__ = ('CurrencyConfig', )
 
@@ -6,10 +14,26 @@ __all__ = ('CurrencyConfig', )
 class CurrencyConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "currency"
-    updater = None
+    updater: 'Updater | None' = None
 
     def ready(self) -> None:
         super().ready()
-        from .parser import Updater
-        self.__class__.updater = Updater()
-        self.__class__.updater.update()
+        if getattr(settings, 'CURRENCY_UPDATE_ON_START', False):
+            self.get_updater().update()
+
+    @classmethod
+    def get_updater(cls) -> 'Updater':
+        """ Updater of this process. Scraping stack (requests, bs4, dateutil)
+        is imported on first call only, so web processes don't load it
+        """
+        if cls.updater is None:
+            from .parser import Updater
+            cls.updater = Updater()
+        return cls.updater
+
+    @classmethod
+    def updating(cls) -> bool:
+        """ Whether database is updated by this or any other process (see markers) """
+        if cls.updater is not None and cls.updater.updating:
+            return True
+        return bool(markers.active(settings.CURRENCY_UPDATING_FOLDER))
@@ -0,0 +1,305 @@
+"""
+Parallel backfill
+
+Work is split into (currency, date_periods() chunk) BackfillTask rows, which
+form durable queue: interrupted backfill continues from where it stopped.
+Tasks are processed by pool of spawned worker processes. Each worker either
+gets its own share of rate limit (delay * workers) or all of them share single
+limiter. Rates are inserted with ignore_conflicts=True in the same transaction
+that marks task done, so repeating task never duplicates or fails on rows
+"""
+from datetime import date
+from hashlib import sha1
+from logging import getLogger
+from multiprocessing import get_context
+from multiprocessing.context import SpawnProcess
+from multiprocessing.sharedctypes import Synchronized
+from multiprocessing.synchronize import Lock
+from os import getpid
+from pathlib import Path
+from time import monotonic, sleep
+
+from dateutil.relativedelta import relativedelta
+from django.conf import settings
+from django.db import connections, transaction
+from django.db.models import F, Max, Q, QuerySet
+import requests
+
+from .metrics import Counter, publish
+from . import coverage, markers
+from .models import *
+from .parser import ANTI_SPAM_SECONDS, FINMARKET_URL, Updater
+from .workers import backfill_worker
+
+__all__ = ('ShardedUpdater', 'page_cache_name', 'enqueue', 'requeue', 'release_abandoned', 'run')
+
+MAX_ATTEMPTS: int = 3
+
+PAGE_CACHE_HITS = Counter(
+    'updater_page_cache_hits_total', "Finmarket pages served from local page cache"
+)
+
+logger = getLogger('db_updater')
+
+
+def page_cache_name(url: str) -> str:
+    """ File name of cached page. Same names are served by benchmark FinmarketStandIn """
+    path = url.removeprefix(FINMARKET_URL)
+    return f"{sha1(path.encode()).hexdigest()}.html"
+
+
+class ShardedUpdater(Updater):
+    """ Updater used by backfill workers: shared rate limiter and local page cache """
+    __slots__ = ('limiter_lock', 'limiter_last', 'cache_dir')
+
+    def __init__(
+            self,
+            sleep_delay: float = 1.,
+            base_url: str = FINMARKET_URL,
+            limiter_lock: Lock | None = None,
+            limiter_last: Synchronized | None = None,
+            cache_dir: Path | None = None
+        ) -> None:
+        super().__init__(sleep_delay=sleep_delay, base_url=base_url)
+        assert (limiter_lock is None) == (limiter_last is None)
+        assert cache_dir is None or cache_dir.is_dir()
+        self.limiter_lock = limiter_lock
+        self.limiter_last = limiter_last
+        self.cache_dir = cache_dir
+
+    def _anti_spam(self) -> None:
+        if self.limiter_lock is None:
+            return super()._anti_spam()
+        assert self.limiter_last is not None
+        # Lock held while sleeping, so workers pass one by one with delay between them
+        with self.limiter_lock:
+            delay = self.delay - (monotonic() - self.limiter_last.value)
+            if delay > 0:
+                sleep(delay)
+                ANTI_SPAM_SECONDS.inc(delay)
+            self.limiter_last.value = monotonic()
+
+    def _fetch(self, url: str, allow_redirects: bool = False) -> str:
+        if self.cache_dir is None:
+            return super()._fetch(url, allow_redirects=allow_redirects)
+        cached = self.cache_dir / page_cache_name(url)
+        if cached.exists():
+            PAGE_CACHE_HITS.inc()
+            return cached.read_text(encoding='windows-1251')
+        status, page = self._request(url, allow_redirects=allow_redirects)
+        if status != 200:
+            # Error and rate-limit pages aren't cached, otherwise task would fail on them forever
+            return page
+        # Rename is atomic, so other workers never read half-written page
+        temporary = cached.with_suffix(f'.{getpid()}.tmp')
+        temporary.write_text(page, encoding='windows-1251')
+        temporary.replace(cached)
+        return page
+
+
+def enqueue(
+        from_date: date | None = None,
+        to_date: date | None = None,
+        reset: bool = False
+    ) -> int:
+    """ Creates tasks covering every currency from its last known rate (or from_date) to to_date
+    :param from_date: Starting date for all currencies. If None, end of last queued
+        task of each currency, day after its last rate if it has no tasks
+        (Updater.MINIMUM_DATE if it has no rates either)
+    :param to_date: Ending date, yesterday if None
+    :param reset: Return done and failed tasks overlapping from_date..to_date to queue.
+        Without it chunks already done (for example, before reseed) are skipped
+    :return: Amount of tasks in queue which aren't done
+    """
+    to_date = date.today() - relativedelta(days=1) if to_date is None else to_date
+    max_dates: dict[int, date] = {
+        i['currencyInfo']: i['date_max']
+        for i in CurrencyRate.objects.values('currencyInfo').annotate(date_max=Max('date'))
+    }
+    # Last rate is usually a few days before end of its chunk (no rates on holidays),
+    # so resuming from it would queue chunks shifted against existing ones
+    queued: dict[int, date] = {
+        i['currencyInfo']: i['date_max']
+        for i in BackfillTask.objects.values('currencyInfo').annotate(date_max=Max('date_to'))
+    }
+    tasks: list[BackfillTask] = []
+    for currency in CurrencyInfo.objects.all():
+        if from_date is not None:
+            start = from_date
+        elif currency.number in queued:
+            # date_to of task is start of the next chunk (see Updater.period_span())
+            start = queued[currency.number]
+        elif currency.number in max_dates:
+            start = max_dates[currency.number] + relativedelta(days=1)
+        else:
+            start = Updater.MINIMUM_DATE
+        if (to_date - start).days < 1:
+            continue
+        dates = Updater.date_periods(from_date=start, to_date=to_date)
+        for date_from, date_to in zip(dates, dates[1:]):
+            tasks.append(BackfillTask(
+                currencyInfo=currency,
+                date_from=date_from,
+                date_to=date_to
+            ))
+    BackfillTask.objects.bulk_create(tasks, ignore_conflicts=True)
+    if reset:
+        overlapping = BackfillTask.objects.filter(date_from__lte=to_date)
+        if from_date is not None:
+            overlapping = overlapping.filter(date_to__gt=from_date)
+        requeue(overlapping)
+    return BackfillTask.objects.exclude(status=BackfillTask.Status.DONE).count()
+
+
+def requeue(tasks: 'QuerySet[BackfillTask] | None' = None) -> int:
+    """ Returns done and failed tasks to queue with attempts counter reset
+    :param tasks: Tasks to requeue, failed tasks if None
+    :return: Amount of requeued tasks
+    """
+    if tasks is None:
+        tasks = BackfillTask.objects.filter(status=BackfillTask.Status.FAILED)
+    return tasks\
+        .filter(status__in=(BackfillTask.Status.DONE, BackfillTask.Status.FAILED))\
+        .update(status=BackfillTask.Status.PENDING, attempts=0, error='')
+
+
+def release_abandoned() -> int:
+    """ Returns tasks left running by killed workers to queue
+    Tasks of workers still alive (other backfill running concurrently) are left to them
+    :return: Amount of released tasks
+    """
+    workers = BackfillTask.objects\
+        .filter(status=BackfillTask.Status.RUNNING, worker__isnull=False)\
+        .values_list('worker', flat=True)\
+        .distinct()
+    dead = [worker for worker in workers if not markers.pid_alive(worker)]
+    return BackfillTask.objects\
+        .filter(status=BackfillTask.Status.RUNNING)\
+        .filter(Q(worker__in=dead) | Q(worker__isnull=True))\
+        .update(status=BackfillTask.Status.PENDING)
+
+
+def _claim(worker: int) -> BackfillTask | None:
+    while True:
+        task = BackfillTask.objects\
+            .filter(status=BackfillTask.Status.PENDING)\
+            .order_by('pk')\
+            .first()
+        if task is None:
+            return None
+        claimed = BackfillTask.objects\
+            .filter(pk=task.pk, status=BackfillTask.Status.PENDING)\
+            .update(
+                status=BackfillTask.Status.RUNNING,
+                worker=worker,
+                attempts=F('attempts') + 1
+            )
+        if claimed:
+            task.refresh_from_db()
+            return task
+
+
+def _process(updater: ShardedUpdater, task: BackfillTask) -> None:
+    currency_rates = updater._get_period_rates(
+        currency=task.currencyInfo,
+        date_from=task.date_from,
+        date_to=task.date_to
+    )
+    with transaction.atomic():
+        if currency_rates:
+            updater._bulk_create('backfill', currency_rates, ignore_conflicts=True)
+        span = updater.period_span(task.date_from, task.date_to)
+        if span is not None:
+            coverage.record((task.currencyInfo_id, ), (span, ))
+        task.status = BackfillTask.Status.DONE
+        task.error = ''
+        task.save(update_fields=('status', 'error'))
+
+
+def _work(
+        index: int,
+        delay: float,
+        base_url: str,
+        limiter_lock: Lock | None,
+        limiter_last: Synchronized | None,
+        cache_dir: Path | None
+    ) -> None:
+    worker = getpid()
+    # Named by index, not pid, so files of previous runs are replaced
+    source = f'backfill-{index}'
+    updater = ShardedUpdater(
+        sleep_delay=delay,
+        base_url=base_url,
+        limiter_lock=limiter_lock,
+        limiter_last=limiter_last,
+        cache_dir=cache_dir
+    )
+    updater.session = requests.Session()
+    try:
+        while (task := _claim(worker)) is not None:
+            try:
+                _process(updater, task)
+            except Exception as e:
+                logger.exception(f"Backfill task {task} failed")
+                task.status = (
+                    BackfillTask.Status.FAILED
+                    if task.attempts >= MAX_ATTEMPTS else
+                    BackfillTask.Status.PENDING
+                )
+                task.error = repr(e)
+                task.save(update_fields=('status', 'error'))
+            publish(settings.CURRENCY_METRICS_FOLDER, source)
+    finally:
+        updater.session.close()
+        updater.session = None
+        connections.close_all()
+
+
+def run(
+        workers: int,
+        delay: float = 1.,
+        shared_limiter: bool = False,
+        cache_dir: Path | None = None,
+        base_url: str = FINMARKET_URL
+    ) -> dict[str, int]:
+    """ Processes all pending tasks with pool of worker processes
+    :param workers: Amount of worker processes
+    :param delay: Delay between requests of the whole pool (as in Updater)
+    :param shared_limiter: If True, workers wait for each other to keep `delay`
+        between any two requests, else each worker keeps `delay * workers` between its own
+    :param cache_dir: Folder of local page cache (disabled if None)
+    :param base_url: Finmarket (or its mirror) URL
+    :return: Amount of tasks by status
+    """
+    assert workers > 0
+    assert delay >= 0
+    release_abandoned()
+
+    # Spawn exists on every platform (fork doesn't on Windows) and doesn't copy
+    # threads or database connections of this process
+    context = get_context('spawn')
+    if shared_limiter:
+        limiter_lock = context.Lock()
+        limiter_last = context.Value('d', 0.)
+        worker_delay = delay
+    else:
+        limiter_lock = limiter_last = None
+        worker_delay = delay * workers
+    processes: list[SpawnProcess] = [
+        context.Process(
+            target=backfill_worker,
+            args=(i, worker_delay, base_url, limiter_lock, limiter_last, cache_dir),
+            name=f'Backfill worker {i}'
+        )
+        for i in range(workers)
+    ]
+    with markers.marked(settings.CURRENCY_UPDATING_FOLDER):
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+
+    return {
+        status: BackfillTask.objects.filter(status=status).count()
+        for status in BackfillTask.Status.values
+    }
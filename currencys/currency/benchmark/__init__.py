@@ -0,0 +1,10 @@
+"""
+Benchmark harness for the currency app
+
+Parts:
+- generator: fills CurrencyInfo/CurrencyRate with synthetic data
+- server: local stand-in for finmarket serving URL_PERIOD/URL_DAY pages
+- scenarios: measured scenarios, each returning JSON-serializable dict
+
+Entry point is `manage.py benchmark`
+"""
@@ -0,0 +1,95 @@
+from random import Random
+from datetime import date, timedelta
+from string import ascii_uppercase
+
+from ..models import *
+
+__all__ = (
+    'NUMBER_OFFSET', 'NUMBER_URL_OFFSET',
+    'create_infos', 'fill_rates', 'synthetic_code', 'synthetic_rate'
+)
+
+NUMBER_OFFSET: int = 1000
+NUMBER_URL_OFFSET: int = 50000
+
+
+def synthetic_code(index: int) -> str:
+    """ Three-letter code of synthetic currency with given index """
+    assert 0 <= index < len(ascii_uppercase) ** 2
+    return 'B' + ascii_uppercase[index // len(ascii_uppercase)] + ascii_uppercase[index % len(ascii_uppercase)]
+
+
+def synthetic_rate(number_url: int, day: date) -> float:
+    """ Deterministic pseudo-random rate for currency on a given day
+    :param number_url: Currency number used in finmarket URLs
+    :param day: Day of rate
+    :return: Rate value, always positive
+    """
+    ordinal = day.toordinal()
+    return 10. + (number_url % 97) + ((ordinal * 7919 + number_url) % 1000) / 100
+
+
+def create_infos(amount: int) -> list[CurrencyInfo]:
+    """ Creates (or reuses) `amount` synthetic currencies
+    :param amount: Amount of currencies
+    :return: List of CurrencyInfo ordered by number
+    """
+    assert isinstance(amount, int)
+    assert 0 < amount <= len(ascii_uppercase) ** 2
+    infos: list[CurrencyInfo] = []
+    for i in range(amount):
+        infos.append(CurrencyInfo(
+            number=NUMBER_OFFSET + i,
+            number_url=NUMBER_URL_OFFSET + i,
+            code=synthetic_code(i),
+            name=f"Benchmark currency {i}",
+            country="Benchmark"
+        ))
+    CurrencyInfo.objects.bulk_create(infos, ignore_conflicts=True)
+    return list(CurrencyInfo.objects
+        .filter(number__gte=NUMBER_OFFSET, number__lt=NUMBER_OFFSET + amount)
+        .order_by('number')
+    )
+
+
+def fill_rates(
+        infos: list[CurrencyInfo],
+        from_date: date,
+        to_date: date,
+        batch_size: int = 10000,
+        seed: int = 0
+    ) -> int:
+    """ Inserts CurrencyRate for every day from_date to to_date for each currency
+    Rates follow random walk, so distribution of values looks like real one
+    :param infos: Currencies to fill
+    :param from_date: Starting date (inclusive)
+    :param to_date: Ending date (inclusive)
+    :param batch_size: Amount of rows per single bulk_create()
+    :param seed: Random seed, same seed gives same rows
+    :return: Amount of generated rows
+    """
+    assert isinstance(from_date, date)
+    assert isinstance(to_date, date)
+    assert from_date <= to_date
+    assert batch_size > 0
+    random = Random(seed)
+    days = (to_date - from_date).days + 1
+    generated = 0
+    currency_rates: list[CurrencyRate] = []
+    for currency in infos:
+        value = synthetic_rate(currency.number_url, from_date)
+        for offset in range(days):
+            value = max(0.0001, value * (1 + random.gauss(0, 0.005)))
+            currency_rates.append(CurrencyRate(
+                currencyInfo=currency,
+                date=from_date + timedelta(days=offset),
+                value=value
+            ))
+            if len(currency_rates) >= batch_size:
+                CurrencyRate.objects.bulk_create(currency_rates, ignore_conflicts=True)
+                generated += len(currency_rates)
+                currency_rates.clear()
+    if currency_rates:
+        CurrencyRate.objects.bulk_create(currency_rates, ignore_conflicts=True)
+        generated += len(currency_rates)
+    return generated
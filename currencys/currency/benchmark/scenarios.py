@@ -0,0 +1,262 @@
+import json
+import os
+import subprocess
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import date, timedelta
+from statistics import mean, median
+from threading import Thread
+from time import perf_counter
+from typing import Any, Callable, Iterator
+
+import requests
+from django.conf import settings
+from django.core.servers.basehttp import ThreadedWSGIServer, WSGIRequestHandler
+from django.core.wsgi import get_wsgi_application
+from django.test import Client
+from django.urls import reverse
+
+from ..models import *
+from .. import parser
+from ..parser import Updater
+from .server import FinmarketStandIn
+
+__all__ = ('backfill', 'info_fetch', 'index_rps', 'cold_start')
+
+MINIMUM_FORM_DATE = date(year=2003, month=1, day=1)
+SCRAPER_MODULES: tuple[str, ...] = (
+    'requests', 'bs4', 'dateutil', 'currency.parser', 'currency.backfill'
+)
+# Executed in fresh interpreter: loads WSGI application and every view of URLconf
+COLD_START_SCRIPT = '''
+import json, sys
+from time import perf_counter
+start = perf_counter()
+from currencys.wsgi import application
+from django.urls import get_resolver
+get_resolver().url_patterns
+seconds = perf_counter() - start
+print(json.dumps({
+    'seconds': seconds,
+    'modules': [name for name in sys.argv[1:] if name in sys.modules],
+}))
+'''
+
+
+def _timings(samples: list[float]) -> dict[str, float]:
+    """ Summary of latencies (in milliseconds) """
+    assert samples
+    ordered = sorted(samples)
+    percentile = lambda p: ordered[min(len(ordered) - 1, int(len(ordered) * p))]
+    return {
+        'count': len(ordered),
+        'mean_ms': mean(ordered) * 1000,
+        'median_ms': median(ordered) * 1000,
+        'p95_ms': percentile(0.95) * 1000,
+        'p99_ms': percentile(0.99) * 1000,
+        'min_ms': ordered[0] * 1000,
+        'max_ms': ordered[-1] * 1000,
+    }
+
+
+def _measure(function: Callable[[], Any], repeat: int) -> list[float]:
+    samples: list[float] = []
+    for _ in range(repeat):
+        start = perf_counter()
+        function()
+        samples.append(perf_counter() - start)
+    return samples
+
+
+def backfill(
+        infos: list[CurrencyInfo],
+        years: int,
+        latency: float = 0.
+    ) -> dict[str, Any]:
+    """ Updater._update_by_periods() throughput against local finmarket stand-in
+    :param infos: Currencies to backfill. Their rates are deleted beforehand
+    :param years: Backfill depth from yesterday
+    :param latency: Artificial latency of every stand-in response (seconds)
+    """
+    assert years > 0
+    CurrencyRate.objects.filter(currencyInfo__in=infos).delete()
+    stages = (
+        parser.REQUEST_SECONDS, parser.HTML_PARSE_SECONDS,
+        parser.EXTRACT_SECONDS, parser.BULK_CREATE_SECONDS
+    )
+    for metric in stages:
+        metric.clear()
+    from_date = date.today() - timedelta(days=365 * years)
+    with FinmarketStandIn(latency=latency, currencies=len(infos)) as stand_in:
+        updater = Updater(sleep_delay=0., base_url=stand_in.url)
+        updater.session = requests.Session()
+        try:
+            start = perf_counter()
+            updater._update_by_periods(
+                from_date=from_date,
+                ids={i.number for i in infos}
+            )
+            duration = perf_counter() - start
+        finally:
+            updater.session.close()
+            updater.session = None
+        page_requests = stand_in.requests
+    rows = CurrencyRate.objects.filter(currencyInfo__in=infos).count()
+    return {
+        'currencies': len(infos),
+        'years': years,
+        'latency_s': latency,
+        'requests': page_requests,
+        'rows': rows,
+        'duration_s': duration,
+        'rows_per_s': rows / duration,
+        'requests_per_s': page_requests / duration,
+        'stages_s': {
+            'request': parser.REQUEST_SECONDS.get_sum(status=200),
+            'html_parse': parser.HTML_PARSE_SECONDS.get_sum(),
+            'extract': parser.EXTRACT_SECONDS.get_sum(kind='period'),
+            'bulk_create': parser.BULK_CREATE_SECONDS.get_sum(mode='period'),
+        },
+    }
+
+
+def info_fetch(
+        infos: list[CurrencyInfo],
+        to_date: date,
+        ranges: list[int],
+        counts: list[int],
+        repeat: int
+    ) -> list[dict[str, Any]]:
+    """ views.info_fetch latency for each combination of date range and currency count
+    :param infos: Currencies with filled rates
+    :param to_date: Ending date of every requested range
+    :param ranges: Range lengths in days
+    :param counts: Amounts of requested currencies
+    :param repeat: Amount of requests per combination
+    """
+    client = Client()
+    url = reverse('currency:fetch')
+    results: list[dict[str, Any]] = []
+    for days in ranges:
+        from_date = max(to_date - timedelta(days=days), MINIMUM_FORM_DATE)
+        for count in counts:
+            count = min(count, len(infos))
+            data = {
+                'fromDay': from_date.day,
+                'fromMonth': from_date.month,
+                'fromYear': from_date.year,
+                'toDay': to_date.day,
+                'toMonth': to_date.month,
+                'toYear': to_date.year,
+                'currencys': [str(i.number) for i in infos[:count]],
+            }
+            response = client.post(url, data)
+            assert response.status_code == 200, (
+                f"info_fetch returned {response.status_code}"
+            )
+            samples = _measure(lambda: client.post(url, data), repeat)
+            results.append({
+                'range_days': (to_date - from_date).days,
+                'currencies': count,
+                'response_bytes': len(response.content),
+                **_timings(samples),
+            })
+    return results
+
+
+def cold_start(repeat: int) -> dict[str, Any]:
+    """ Web process cold start: time to load WSGI application and URLconf in fresh
+    interpreter, and proof that scraping stack (SCRAPER_MODULES) isn't imported on the way
+    :param repeat: Amount of started interpreters
+    """
+    assert repeat > 0
+    environment = {
+        **os.environ,
+        'DJANGO_SETTINGS_MODULE': os.environ.get('DJANGO_SETTINGS_MODULE', 'currencys.settings'),
+        'CURRENCY_UPDATE_ON_START': '0',
+    }
+    command = [sys.executable, '-X', 'importtime', '-c', COLD_START_SCRIPT, *SCRAPER_MODULES]
+    samples: list[float] = []
+    imported: set[str] = set()
+    imports: dict[str, int] = {}
+    for _ in range(repeat):
+        process = subprocess.run(
+            command,
+            cwd=settings.BASE_DIR,
+            env=environment,
+            capture_output=True,
+            text=True,
+            check=True
+        )
+        output = json.loads(process.stdout.splitlines()[-1])
+        samples.append(output['seconds'])
+        imported.update(output['modules'])
+        # -X importtime lines: "import time: self [us] | cumulative | imported package"
+        for line in process.stderr.splitlines():
+            parts = line.removeprefix('import time:').split('|')
+            if len(parts) != 3 or not parts[0].strip().isdigit():
+                continue
+            imports[parts[2].strip()] = int(parts[0])
+    slowest = sorted(imports.items(), key=lambda i: i[1], reverse=True)[:10]
+    return {
+        'scraper_modules_imported': sorted(imported),
+        'lazy': not imported,
+        'slowest_imports_self_ms': {name: us / 1000 for name, us in slowest},
+        **_timings(samples),
+    }
+
+
+class _QuietHandler(WSGIRequestHandler):
+    def log_message(self, format: str, *args) -> None:
+        pass
+
+
+@contextmanager
+def _live_server() -> Iterator[str]:
+    """ Web application served by threaded WSGI server (as runserver) in background thread
+    :return: Base URL of server
+    """
+    server = ThreadedWSGIServer(('127.0.0.1', 0), _QuietHandler, allow_reuse_address=False)
+    server.set_app(get_wsgi_application())
+    thread = Thread(target=server.serve_forever, name='Benchmark web server', daemon=True)
+    thread.start()
+    try:
+        host, port = server.server_address[:2]
+        yield f"http://{host}:{port}"
+    finally:
+        server.shutdown()
+        server.server_close()
+        thread.join()
+
+
+def index_rps(duration: float, clients: int) -> dict[str, Any]:
+    """ Throughput of views.index under `clients` concurrent clients for `duration` seconds
+    Requests go over HTTP to live threaded server, so they include request handling
+    threads contending for GIL and database
+    """
+    assert duration > 0
+    assert clients > 0
+
+    def client(url: str, deadline: float) -> list[float]:
+        samples: list[float] = []
+        with requests.Session() as session:
+            while perf_counter() < deadline:
+                start = perf_counter()
+                response = session.get(url)
+                samples.append(perf_counter() - start)
+                assert response.status_code == 200, f"index returned {response.status_code}"
+        return samples
+
+    with _live_server() as base_url, ThreadPoolExecutor(clients) as executor:
+        url = base_url + reverse('currency:index')
+        start = perf_counter()
+        futures = [executor.submit(client, url, start + duration) for _ in range(clients)]
+        samples = [sample for future in futures for sample in future.result()]
+        wall = perf_counter() - start
+    return {
+        'clients': clients,
+        'duration_s': wall,
+        'rps': len(samples) / wall,
+        **_timings(samples),
+    }
@@ -0,0 +1,134 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+from threading import Thread
+from datetime import date, timedelta
+from pathlib import Path
+from time import sleep
+
+from ..backfill import page_cache_name
+from .generator import NUMBER_URL_OFFSET, synthetic_code, synthetic_rate
+
+__all__ = ('FinmarketStandIn', )
+
+
+class FinmarketStandIn:
+    """ Local HTTP server imitating finmarket pages used by Updater
+    Serves URL_PERIOD and URL_DAY pages with synthetic rates for every day.
+    If `recorded` folder given (for example, backfill page cache), pages saved there
+    with name page_cache_name(path) are served instead of synthetic ones
+    """
+    __slots__ = ('latency', 'currencies', 'recorded', 'requests', 'server', 'thread')
+
+    def __init__(
+            self,
+            latency: float = 0.,
+            currencies: int = 42,
+            recorded: Path | None = None
+        ) -> None:
+        assert isinstance(latency, float)
+        assert latency >= 0
+        assert recorded is None or recorded.is_dir()
+        self.latency = latency
+        self.currencies = currencies
+        self.recorded = recorded
+        self.requests: int = 0
+        self.server: ThreadingHTTPServer | None = None
+        self.thread: Thread | None = None
+
+    @property
+    def url(self) -> str:
+        assert self.server is not None
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def __enter__(self) -> 'FinmarketStandIn':
+        assert self.server is None
+        stand_in = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self) -> None:
+                stand_in.requests += 1
+                if stand_in.latency:
+                    sleep(stand_in.latency)
+                page = stand_in.page(self.path)
+                if page is None:
+                    self.send_error(404)
+                    return
+                body = page.encode('windows-1251')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/html; charset=windows-1251')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format: str, *args) -> None:
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.thread = Thread(
+            target=self.server.serve_forever,
+            name='Finmarket stand-in',
+            daemon=True
+        )
+        self.thread.start()
+        return self
+
+    def __exit__(self, *args) -> None:
+        assert self.server is not None
+        assert self.thread is not None
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+        self.server = None
+        self.thread = None
+
+    def page(self, path: str) -> str | None:
+        if self.recorded is not None:
+            recorded = self.recorded / page_cache_name(path)
+            if recorded.exists():
+                return recorded.read_text(encoding='windows-1251')
+        query = {k: v[0] for k, v in parse_qs(urlsplit(path).query).items()}
+        if 'cur' in query:
+            return self._period_page(
+                number_url=int(query['cur']),
+                from_date=date(int(query['by']), int(query['bm']), int(query['bd'])),
+                to_date=date(int(query['ey']), int(query['em']), int(query['ed']))
+            )
+        if 'bd' in query:
+            return self._day_page(date(int(query['by']), int(query['bm']), int(query['bd'])))
+        return None
+
+    @staticmethod
+    def _number(value: float) -> str:
+        return f"{value:.4f}".replace('.', ',')
+
+    def _period_page(self, number_url: int, from_date: date, to_date: date) -> str:
+        # Updater iterates over tags directly, so no whitespace between them allowed
+        rows: list[str] = []
+        day = from_date
+        while day <= to_date:
+            rate = synthetic_rate(number_url, day)
+            change = rate - synthetic_rate(number_url, day - timedelta(days=1))
+            rows.append(
+                f"<tr><td>{day:%d.%m.%Y}</td><td>1</td>"
+                f"<td>{self._number(rate)}</td><td>{self._number(change)}</td></tr>"
+            )
+            day += timedelta(days=1)
+        return (
+            "<html><body><table class=\"karramba\"><tbody>"
+            f"{''.join(rows)}"
+            "</tbody></table></body></html>"
+        )
+
+    def _day_page(self, day: date) -> str:
+        rows: list[str] = []
+        for i in range(self.currencies):
+            number_url = NUMBER_URL_OFFSET + i
+            rate = synthetic_rate(number_url, day)
+            change = rate - synthetic_rate(number_url, day - timedelta(days=1))
+            rows.append(
+                f"<tr><td>{synthetic_code(i)}</td>"
+                f"<td>Benchmark currency {i}</td><td>1</td>"
+                f"<td>{self._number(rate)}</td><td>{self._number(change)}</td></tr>"
+            )
+        return f"<html><body><table><tbody>{''.join(rows)}</tbody></table></body></html>"
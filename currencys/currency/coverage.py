@@ -0,0 +1,234 @@
+"""
+Coverage index of downloaded rates
+
+For each currency RateCoverage keeps run-length set of date ordinals
+([start, end] runs, both inclusive) which were successfully downloaded.
+Covered means "requested and saved", not "has rate": finmarket has no rates
+on holidays, so such days are covered by the period request they belong to.
+Days absent from coverage (failed periods, skipped days) are gaps, and
+repair downloads only them with the smallest set of URL_PERIOD requests
+"""
+from datetime import date, timedelta
+from typing import TYPE_CHECKING, Iterable
+
+from django.db import transaction
+
+from .models import *
+
+if TYPE_CHECKING:
+    from .parser import Updater
+
+__all__ = (
+    'add_span', 'missing', 'plan_requests', 'runs_from_ordinals', 'last_fetched_day',
+    'record', 'rebuild', 'uncovered', 'gaps', 'plan', 'repair'
+)
+
+Runs = list[list[int]]
+
+# Rebuilding from rates can't tell holidays from gaps, so holes up to this many days are covered
+REBUILD_TOLERANCE: int = 10
+# Longest span of single URL_PERIOD request (same as Updater.date_periods() chunks)
+MAX_REQUEST_DAYS: int = 730
+
+
+def add_span(runs: Runs, start: int, end: int) -> Runs:
+    """ Adds [start, end] to runs, merging overlapping and adjacent ones
+    :param runs: Sorted non-overlapping runs
+    :return: New sorted non-overlapping runs
+    """
+    assert start <= end
+    merged: Runs = []
+    placed = False
+    for run_start, run_end in runs:
+        if run_end + 1 < start:
+            merged.append([run_start, run_end])
+        elif end + 1 < run_start:
+            if not placed:
+                merged.append([start, end])
+                placed = True
+            merged.append([run_start, run_end])
+        else:
+            start, end = min(start, run_start), max(end, run_end)
+    if not placed:
+        merged.append([start, end])
+    return merged
+
+
+def missing(runs: Runs, start: int, end: int) -> list[tuple[int, int]]:
+    """ Spans of [start, end] not covered by runs """
+    spans: list[tuple[int, int]] = []
+    current = start
+    for run_start, run_end in runs:
+        if run_end < current:
+            continue
+        if run_start > end:
+            break
+        if run_start > current:
+            spans.append((current, run_start - 1))
+        current = run_end + 1
+    if current <= end:
+        spans.append((current, end))
+    return spans
+
+
+def plan_requests(spans: list[tuple[int, int]], max_days: int = MAX_REQUEST_DAYS) -> list[tuple[int, int]]:
+    """ Smallest set of requests (each up to max_days long) covering all spans
+    Greedy: request starts at first uncovered day and takes as many following spans
+    as fit. Already covered days between spans are downloaded again, which is harmless
+    """
+    requests: list[tuple[int, int]] = []
+    for start, end in sorted(spans):
+        while start <= end:
+            if requests and start <= requests[-1][0] + max_days - 1:
+                request_start, request_end = requests[-1]
+                request_end = max(request_end, min(end, request_start + max_days - 1))
+                requests[-1] = (request_start, request_end)
+            else:
+                request_start, request_end = start, min(end, start + max_days - 1)
+                requests.append((request_start, request_end))
+            start = request_end + 1
+    return requests
+
+
+def runs_from_ordinals(ordinals: Iterable[int], tolerance: int = REBUILD_TOLERANCE) -> Runs:
+    """ Runs of sorted ordinals of stored rates
+    :param tolerance: Holes up to this many days are treated as holidays (covered)
+    """
+    runs: Runs = []
+    for ordinal in ordinals:
+        if runs and ordinal <= runs[-1][1] + tolerance + 1:
+            runs[-1][1] = max(runs[-1][1], ordinal)
+        else:
+            runs.append([ordinal, ordinal])
+    return runs
+
+
+def last_fetched_day() -> date:
+    """ Last day downloaded by Updater: update by periods requests up to the day
+    before last date_periods() date (yesterday), update by days stops before yesterday
+    """
+    return date.today() - timedelta(days=2)
+
+
+def record(numbers: Iterable[int], spans: Iterable[tuple[date, date]]) -> None:
+    """ Marks spans (both dates inclusive) as covered for every given currency
+    Called after rates of spans are saved. Should be called inside the same transaction
+    """
+    spans = [(start.toordinal(), end.toordinal()) for start, end in spans]
+    if not spans:
+        return
+    with transaction.atomic():
+        for number in numbers:
+            coverage, _ = RateCoverage.objects\
+                .select_for_update()\
+                .get_or_create(currencyInfo_id=number)
+            runs: Runs = coverage.runs
+            for start, end in spans:
+                runs = add_span(runs, start, end)
+            coverage.runs = runs
+            coverage.save(update_fields=('runs', ))
+
+
+def rebuild(numbers: Iterable[int] | None = None, tolerance: int = REBUILD_TOLERANCE) -> None:
+    """ Recomputes coverage from stored rates
+    :param numbers: Currencies to rebuild, all if None
+    :param tolerance: Holes up to this many days are treated as holidays (covered)
+    """
+    currencies = CurrencyInfo.objects.all()
+    if numbers is not None:
+        currencies = currencies.filter(number__in=list(numbers))
+    for number in currencies.values_list('number', flat=True):
+        dates = CurrencyRate.objects\
+            .filter(currencyInfo_id=number)\
+            .order_by('date')\
+            .values_list('date', flat=True)\
+            .iterator()
+        runs = runs_from_ordinals((i.toordinal() for i in dates), tolerance)
+        RateCoverage.objects.update_or_create(
+            currencyInfo_id=number,
+            defaults={'runs': runs}
+        )
+
+
+def uncovered() -> list[int]:
+    """ Currencies without any covered day (never downloaded or index not built) """
+    return [
+        number
+        for number, runs in CurrencyInfo.objects.values_list('number', 'ratecoverage__runs')
+        if not runs
+    ]
+
+
+def gaps(
+        number: int,
+        from_date: date | None = None,
+        to_date: date | None = None
+    ) -> list[tuple[date, date]]:
+    """ Uncovered spans of currency
+    :param from_date: Starting date. If None, first covered day (days before it are
+        start of history, not gaps), or Updater.MINIMUM_DATE for currency without coverage
+    :param to_date: Ending date, last_fetched_day() if None
+    """
+    coverage = RateCoverage.objects.filter(currencyInfo_id=number).first()
+    runs: Runs = [] if coverage is None else coverage.runs
+    if from_date is not None:
+        start = from_date.toordinal()
+    elif runs:
+        start = runs[0][0]
+    else:
+        from .parser import Updater
+        start = Updater.MINIMUM_DATE.toordinal()
+    end = (last_fetched_day() if to_date is None else to_date).toordinal()
+    return [
+        (date.fromordinal(span_start), date.fromordinal(span_end))
+        for span_start, span_end in missing(runs, start, end)
+    ]
+
+
+def plan(
+        from_date: date | None = None,
+        to_date: date | None = None,
+        with_uncovered: bool = False
+    ) -> dict[int, list[tuple[date, date]]]:
+    """ URL_PERIOD requests (both dates inclusive) repairing gaps of every currency
+    :param with_uncovered: Plan currencies without coverage too. Without from_date
+        it's their whole history, which on database without built index means
+        downloading everything again, so by default they are skipped
+    """
+    skipped = set() if with_uncovered or from_date is not None else set(uncovered())
+    result: dict[int, list[tuple[date, date]]] = {}
+    for number in CurrencyInfo.objects.values_list('number', flat=True):
+        if number in skipped:
+            continue
+        spans = [
+            (start.toordinal(), end.toordinal())
+            for start, end in gaps(number, from_date, to_date)
+        ]
+        if spans:
+            result[number] = [
+                (date.fromordinal(start), date.fromordinal(end))
+                for start, end in plan_requests(spans)
+            ]
+    return result
+
+
+def repair(updater: 'Updater', requests: dict[int, list[tuple[date, date]]]) -> int:
+    """ Downloads planned requests and marks them covered
+    :param updater: Updater with opened session
+    :param requests: Result of plan()
+    :return: Amount of rows passed to database
+    """
+    rows = 0
+    for number, spans in requests.items():
+        currency = CurrencyInfo.objects.get(number=number)
+        for start, end in spans:
+            if start == end:
+                # Updater skips single day periods
+                start -= timedelta(days=1)
+            currency_rates = updater._get_period_rates(currency, start, end + timedelta(days=1))
+            with transaction.atomic():
+                if currency_rates:
+                    updater._bulk_create('repair', currency_rates, ignore_conflicts=True)
+                record((number, ), ((start, end), ))
+            rows += len(currency_rates)
+    return rows
@@ -2,6 +2,14 @@ from datetime import datetime
 
 from django import forms
 
+from .models import CurrencyInfo
+
+
+def _currency_choices() -> list[tuple[int, str]]:
+    # Callable choices are evaluated on every form, so new currencies appear without restart
+    return list(CurrencyInfo.objects.values_list('number', 'name'))
+
+
 class DatesForm(forms.Form):
     __slots__ = ('dt_from', 'dt_to')
 
@@ -11,7 +19,7 @@ class DatesForm(forms.Form):
     toDay = forms.IntegerField(min_value=1, max_value=31)
     toMonth = forms.IntegerField(min_value=1, max_value=12)
     toYear = forms.IntegerField(min_value=2003, max_value=datetime.now().year)
-    currencys = forms.MultipleChoiceField(required=True)
+    currencys = forms.MultipleChoiceField(required=True, choices=_currency_choices)
 
     def clean(self) -> None:
         data = self.cleaned_data
@@ -0,0 +1,61 @@
+from datetime import date
+from os import cpu_count
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandParser
+
+from ...apps import CurrencyConfig
+from ...parser import FINMARKET_URL
+from ... import backfill
+
+
+class Command(BaseCommand):
+    help = (
+        "Downloads missing rates of all currencies with pool of worker processes. "
+        "Work queue is kept in database, so interrupted backfill can be continued"
+    )
+
+    def add_arguments(self, parser: CommandParser) -> None:
+        parser.add_argument('--workers', type=int, default=cpu_count() or 1)
+        parser.add_argument('--delay', type=float, default=1.,
+            help="Delay between requests of the whole pool (seconds)")
+        parser.add_argument('--shared-limiter', action='store_true',
+            help="Workers coordinate through single limiter instead of splitting delay")
+        parser.add_argument('--cache-dir', type=Path, default=None,
+            help="Folder of local page cache. Cached pages are not requested again")
+        parser.add_argument('--base-url', default=FINMARKET_URL,
+            help="Finmarket mirror to download pages from")
+        parser.add_argument('--from-date', type=date.fromisoformat, default=None,
+            help="Starting date (YYYY-MM-DD) for all currencies instead of their last rate")
+        parser.add_argument('--to-date', type=date.fromisoformat, default=None,
+            help="Ending date (YYYY-MM-DD), yesterday by default")
+        parser.add_argument('--reset', action='store_true',
+            help="Requeue done and failed tasks overlapping requested dates (reseed)")
+        parser.add_argument('--retry-failed', action='store_true',
+            help="Requeue tasks failed in previous runs")
+
+    def handle(self, *args, **options) -> None:
+        if CurrencyConfig.updating():
+            self.stderr.write(
+                "Warning: database updater is running in background "
+                "and may download the same rates"
+            )
+        if options['cache_dir'] is not None:
+            options['cache_dir'].mkdir(parents=True, exist_ok=True)
+
+        if options['retry_failed']:
+            self.stdout.write(f"{backfill.requeue()} failed tasks requeued")
+        pending = backfill.enqueue(
+            from_date=options['from_date'],
+            to_date=options['to_date'],
+            reset=options['reset']
+        )
+        self.stdout.write(f"{pending} tasks in queue, starting {options['workers']} workers")
+        statuses = backfill.run(
+            workers=options['workers'],
+            delay=options['delay'],
+            shared_limiter=options['shared_limiter'],
+            cache_dir=options['cache_dir'],
+            base_url=options['base_url']
+        )
+        self.stdout.write(', '.join(f"{status}: {amount}" for status, amount in statuses.items()))
@@ -0,0 +1,127 @@
+import json
+import platform
+from datetime import date, datetime, timedelta
+from pathlib import Path
+from time import perf_counter
+from typing import Any
+
+from django.core.management.base import BaseCommand, CommandError, CommandParser
+from django.db import connection
+
+from ...apps import CurrencyConfig
+from ...benchmark import generator, scenarios
+
+SCENARIOS = ('startup', 'backfill', 'info_fetch', 'index')
+
+
+def _int_list(value: str) -> list[int]:
+    return [int(i) for i in value.split(',') if i]
+
+
+class Command(BaseCommand):
+    help = (
+        "Runs benchmark scenarios on a throwaway test database "
+        "and writes results as JSON"
+    )
+
+    def add_arguments(self, parser: CommandParser) -> None:
+        parser.add_argument('--output', type=Path, default=None,
+            help="JSON file for results (stdout if omitted)")
+        parser.add_argument('--scenarios', type=lambda v: v.split(','),
+            default=list(SCENARIOS), help=f"Comma separated subset of {','.join(SCENARIOS)}")
+        parser.add_argument('--currencies', type=int, default=42,
+            help="Amount of generated currencies")
+        parser.add_argument('--years', type=int, default=20,
+            help="Depth of generated rate history (one row per currency per day)")
+        parser.add_argument('--backfill-currencies', type=int, default=5)
+        parser.add_argument('--backfill-years', type=int, default=10)
+        parser.add_argument('--latency', type=float, default=0.,
+            help="Latency of every finmarket stand-in response (seconds)")
+        parser.add_argument('--ranges', type=_int_list, default=[30, 365, 3650],
+            help="info_fetch date ranges in days")
+        parser.add_argument('--counts', type=_int_list, default=[1, 5, 42],
+            help="info_fetch currency counts")
+        parser.add_argument('--repeat', type=int, default=20,
+            help="Requests per info_fetch combination")
+        parser.add_argument('--index-duration', type=float, default=5.,
+            help="Seconds to hammer index page")
+        parser.add_argument('--index-clients', type=int, default=8,
+            help="Concurrent clients requesting index page")
+        parser.add_argument('--startup-repeat', type=int, default=5,
+            help="Fresh interpreters started to measure web process cold start")
+
+    def handle(self, *args, **options) -> None:
+        unknown = set(options['scenarios']) - set(SCENARIOS)
+        if unknown:
+            raise CommandError(f"Unknown scenarios: {', '.join(sorted(unknown))}")
+        if CurrencyConfig.updating():
+            self.stderr.write(
+                "Warning: database updater is running in background, "
+                "results may be affected"
+            )
+
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            results = self._run(options)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+        dumped = json.dumps(results, indent=2)
+        if options['output'] is None:
+            self.stdout.write(dumped)
+        else:
+            options['output'].write_text(dumped, encoding='utf-8')
+            self.stdout.write(f"Results written to {options['output']}")
+
+    def _run(self, options: dict[str, Any]) -> dict[str, Any]:
+        results: dict[str, Any] = {
+            'meta': {
+                'started': datetime.now().isoformat(),
+                'python': platform.python_version(),
+                'platform': platform.platform(),
+                'database': connection.vendor,
+                'options': {
+                    k: (str(v) if isinstance(v, Path) else v)
+                    for k, v in options.items()
+                    if k not in {'stdout', 'stderr'}
+                },
+            },
+            'scenarios': {},
+        }
+        if 'startup' in options['scenarios']:
+            results['scenarios']['startup'] = scenarios.cold_start(options['startup_repeat'])
+
+        infos = generator.create_infos(max(options['currencies'], options['backfill_currencies']))
+
+        if 'backfill' in options['scenarios']:
+            results['scenarios']['backfill'] = scenarios.backfill(
+                infos=infos[:options['backfill_currencies']],
+                years=options['backfill_years'],
+                latency=options['latency']
+            )
+
+        if not {'info_fetch', 'index'} & set(options['scenarios']):
+            return results
+        to_date = date.today() - timedelta(days=1)
+        from_date = to_date - timedelta(days=365 * options['years'])
+        start = perf_counter()
+        rows = generator.fill_rates(infos[:options['currencies']], from_date, to_date)
+        results['scenarios']['generate'] = {
+            'rows': rows,
+            'duration_s': perf_counter() - start,
+        }
+
+        if 'info_fetch' in options['scenarios']:
+            results['scenarios']['info_fetch'] = scenarios.info_fetch(
+                infos=infos[:options['currencies']],
+                to_date=to_date,
+                ranges=options['ranges'],
+                counts=options['counts'],
+                repeat=options['repeat']
+            )
+        if 'index' in options['scenarios']:
+            results['scenarios']['index'] = scenarios.index_rps(
+                duration=options['index_duration'],
+                clients=options['index_clients']
+            )
+        return results
@@ -0,0 +1,19 @@
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandParser
+
+from ... import snapshot
+
+
+class Command(BaseCommand):
+    help = "Exports all currencies and rates to compact snapshot file"
+
+    def add_arguments(self, parser: CommandParser) -> None:
+        parser.add_argument('path', type=Path)
+
+    def handle(self, *args, **options) -> None:
+        stats = snapshot.dump(options['path'])
+        self.stdout.write(
+            f"Exported {stats['rows']} rates of {stats['currencies']} currencies "
+            f"to {options['path']} ({stats['bytes']} bytes)"
+        )
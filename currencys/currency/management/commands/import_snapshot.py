@@ -0,0 +1,24 @@
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError, CommandParser
+
+from ... import snapshot
+
+
+class Command(BaseCommand):
+    help = "Imports currencies and rates from snapshot file"
+
+    def add_arguments(self, parser: CommandParser) -> None:
+        parser.add_argument('path', type=Path)
+        parser.add_argument('--incremental', action='store_true',
+            help="Import only rates newer than latest stored rate of each currency")
+
+    def handle(self, *args, **options) -> None:
+        try:
+            stats = snapshot.load(options['path'], incremental=options['incremental'])
+        except snapshot.SnapshotError as e:
+            raise CommandError(str(e)) from e
+        self.stdout.write(
+            f"Imported {stats['rows']} rates ({stats['inserted']} passed to database) "
+            f"of {stats['currencies']} currencies from {options['path']}"
+        )
@@ -0,0 +1,69 @@
+from datetime import date
+
+import requests
+from django.core.management.base import BaseCommand, CommandParser
+
+from ...apps import CurrencyConfig
+from ...parser import FINMARKET_URL, Updater
+from ... import coverage
+
+
+class Command(BaseCommand):
+    help = (
+        "Finds days missing from coverage index of each currency "
+        "and downloads only them with the smallest set of period requests"
+    )
+
+    def add_arguments(self, parser: CommandParser) -> None:
+        parser.add_argument('--rebuild', action='store_true',
+            help="Rebuild coverage from stored rates first (needed once for existing databases)")
+        parser.add_argument('--tolerance', type=int, default=coverage.REBUILD_TOLERANCE,
+            help="With --rebuild, holes up to this many days are treated as holidays")
+        parser.add_argument('--from-date', type=date.fromisoformat, default=None,
+            help="Look for gaps from this date (YYYY-MM-DD), first covered day by default "
+                 "(the whole history for currencies without coverage)")
+        parser.add_argument('--to-date', type=date.fromisoformat, default=None,
+            help="Look for gaps up to this date (YYYY-MM-DD), "
+                 "last day downloaded by updater (two days ago) by default")
+        parser.add_argument('--dry-run', action='store_true',
+            help="Only print planned requests")
+        parser.add_argument('--delay', type=float, default=1.)
+        parser.add_argument('--base-url', default=FINMARKET_URL)
+
+    def handle(self, *args, **options) -> None:
+        if CurrencyConfig.updating():
+            self.stderr.write(
+                "Warning: database updater is running in background, "
+                "days it is downloading now are reported as gaps"
+            )
+        if options['rebuild']:
+            coverage.rebuild(tolerance=options['tolerance'])
+
+        # After rebuild currencies without coverage have no rates at all and
+        # need whole history, otherwise they likely just have no index yet
+        with_uncovered = options['rebuild'] or options['from_date'] is not None
+        uncovered = coverage.uncovered()
+        if uncovered and not with_uncovered:
+            self.stdout.write(
+                f"Skipping {len(uncovered)} currencies without coverage "
+                f"(run with --rebuild to build index from stored rates, "
+                f"or give --from-date): " + ', '.join(map(str, uncovered))
+            )
+        planned = coverage.plan(options['from_date'], options['to_date'], with_uncovered)
+        for number, spans in planned.items():
+            self.stdout.write(f"{number}: " + ', '.join(f"{start}->{end}" for start, end in spans))
+        self.stdout.write(
+            f"{sum(map(len, planned.values()))} requests "
+            f"for {len(planned)} currencies planned"
+        )
+        if options['dry_run'] or not planned:
+            return
+
+        updater = Updater(sleep_delay=options['delay'], base_url=options['base_url'])
+        updater.session = requests.Session()
+        try:
+            rows = coverage.repair(updater, planned)
+        finally:
+            updater.session.close()
+            updater.session = None
+        self.stdout.write(f"Repaired, {rows} rates passed to database")
@@ -0,0 +1,43 @@
+from time import monotonic
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandParser
+
+from ...apps import CurrencyConfig
+from ... import metrics
+
+
+class Command(BaseCommand):
+    help = (
+        "Runs database update (the one CURRENCY_UPDATE_ON_START runs in background) "
+        "in foreground"
+    )
+
+    def add_arguments(self, parser: CommandParser) -> None:
+        parser.add_argument('--metrics', action='store_true',
+            help="Print updater metrics in Prometheus text format when update finishes")
+        parser.add_argument('--metrics-interval', type=float, default=None,
+            help="Print updater metrics every INTERVAL seconds while updating")
+        parser.add_argument('--publish-interval', type=float, default=15.,
+            help="Publish metrics for /currency/metrics every INTERVAL seconds while updating")
+
+    def handle(self, *args, **options) -> None:
+        updater = CurrencyConfig.get_updater()
+        if updater.update_thread is None:
+            updater.update()
+        assert updater.update_thread is not None
+        interval: float | None = options['metrics_interval']
+        publish_interval: float = options['publish_interval']
+        assert publish_interval > 0
+        printed = monotonic()
+        while updater.update_thread.is_alive():
+            updater.update_thread.join(
+                publish_interval if interval is None else min(interval, publish_interval)
+            )
+            metrics.publish(settings.CURRENCY_METRICS_FOLDER, 'update_rates')
+            if interval is not None and monotonic() - printed >= interval:
+                printed = monotonic()
+                self.stdout.write(metrics.render())
+        metrics.publish(settings.CURRENCY_METRICS_FOLDER, 'update_rates')
+        if options['metrics'] or interval is not None:
+            self.stdout.write(metrics.render())
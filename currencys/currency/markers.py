@@ -0,0 +1,71 @@
+"""
+Cross-process markers of running updates
+
+Database is updated by other processes than web ones (update_rates, backfill,
+single process with CURRENCY_UPDATE_ON_START). Each of them keeps `pid`.pid
+file in CURRENCY_UPDATING_FOLDER while updating, so any process can tell
+whether update is running. Files of killed processes are removed on check
+"""
+import os
+import sys
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterator
+
+__all__ = ('pid_alive', 'marked', 'active')
+
+
+def pid_alive(pid: int) -> bool:
+    """ Whether process with given pid exists """
+    assert isinstance(pid, int)
+    if pid <= 0:
+        return False
+    if sys.platform == 'win32':
+        # os.kill() terminates process on Windows, so its state is queried instead
+        import ctypes
+        kernel32 = ctypes.windll.kernel32
+        handle = kernel32.OpenProcess(0x1000, False, pid)  # PROCESS_QUERY_LIMITED_INFORMATION
+        if not handle:
+            return False
+        try:
+            code = ctypes.c_ulong()
+            if not kernel32.GetExitCodeProcess(handle, ctypes.byref(code)):
+                return False
+            return code.value == 259  # STILL_ACTIVE
+        finally:
+            kernel32.CloseHandle(handle)
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+@contextmanager
+def marked(folder: Path) -> Iterator[None]:
+    """ Marks this process as updating while block is executed """
+    folder.mkdir(parents=True, exist_ok=True)
+    marker = folder / f'{os.getpid()}.pid'
+    marker.touch()
+    try:
+        yield
+    finally:
+        marker.unlink(missing_ok=True)
+
+
+def active(folder: Path) -> list[int]:
+    """ Pids of updating processes, markers of dead ones are removed """
+    if not folder.is_dir():
+        return []
+    pids: list[int] = []
+    for marker in folder.glob('*.pid'):
+        if not marker.stem.isdigit():
+            continue
+        pid = int(marker.stem)
+        if pid_alive(pid):
+            pids.append(pid)
+        else:
+            marker.unlink(missing_ok=True)
+    return sorted(pids)
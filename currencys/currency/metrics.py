@@ -0,0 +1,202 @@
+"""
+In-process metrics in Prometheus text exposition format
+
+Metrics are module-level singletons registered in REGISTRY on creation,
+so any module can import and update them. Values live in process memory
+only and are reset on restart. Processes other than web one (update_rates,
+backfill workers) publish() their metrics to textfiles, which web process
+collect()s together with its own
+"""
+from bisect import bisect_left
+from os import getpid
+from pathlib import Path
+from threading import Lock
+from typing import Iterable
+
+__all__ = ('Counter', 'Gauge', 'Histogram', 'REGISTRY', 'render', 'publish', 'collect')
+
+REGISTRY: list['_Metric'] = []
+DEFAULT_BUCKETS: tuple[float, ...] = (
+    .005, .01, .025, .05, .1, .25, .5, 1., 2.5, 5., 10.
+)
+
+
+def _format_labels(names: tuple[str, ...], values: tuple[str, ...], *extra: str) -> str:
+    pairs = [
+        f'{name}="{value}"'
+        for name, value in zip(names, values)
+    ]
+    pairs.extend(i for i in extra if i)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_value(value: float) -> str:
+    return repr(float(value)) if value != float('inf') else '+Inf'
+
+
+class _Metric:
+    type: str = ''
+    __slots__ = ('name', 'documentation', 'label_names', 'lock', 'values')
+
+    def __init__(self, name: str, documentation: str, labels: Iterable[str] = ()) -> None:
+        assert isinstance(name, str)
+        assert all(metric.name != name for metric in REGISTRY), f"Metric {name} already exists"
+        self.name = name
+        self.documentation = documentation
+        self.label_names: tuple[str, ...] = tuple(labels)
+        self.lock = Lock()
+        self.values: dict[tuple[str, ...], float] = dict()
+        REGISTRY.append(self)
+
+    def _key(self, labels: dict[str, object]) -> tuple[str, ...]:
+        assert set(labels) == set(self.label_names), (
+            f"Metric {self.name} expects labels {self.label_names}, got {tuple(labels)}"
+        )
+        return tuple(str(labels[name]) for name in self.label_names)
+
+    def get(self, **labels: object) -> float:
+        return self.values.get(self._key(labels), 0.)
+
+    def clear(self) -> None:
+        with self.lock:
+            self.values.clear()
+
+    def samples(self, extra: str = '') -> Iterable[str]:
+        """ :param extra: Formatted labels added to every sample """
+        for key, value in sorted(self.values.items()):
+            yield f"{self.name}{_format_labels(self.label_names, key, extra)} {_format_value(value)}"
+
+    def render(self, extra: str = '') -> str:
+        return '\n'.join((
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.type}",
+            *self.samples(extra)
+        ))
+
+
+class Counter(_Metric):
+    type = 'counter'
+    __slots__ = ()
+
+    def inc(self, amount: float = 1., **labels: object) -> None:
+        assert amount >= 0, "Counter can only increase"
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0.) + amount
+
+
+class Gauge(_Metric):
+    type = 'gauge'
+    __slots__ = ()
+
+    def set(self, value: float, **labels: object) -> None:
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = value
+
+    def inc(self, amount: float = 1., **labels: object) -> None:
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0.) + amount
+
+
+class Histogram(_Metric):
+    type = 'histogram'
+    __slots__ = ('buckets', 'counts', 'sums')
+
+    def __init__(
+            self,
+            name: str,
+            documentation: str,
+            labels: Iterable[str] = (),
+            buckets: Iterable[float] = DEFAULT_BUCKETS
+        ) -> None:
+        super().__init__(name, documentation, labels)
+        self.buckets: tuple[float, ...] = tuple(sorted(buckets)) + (float('inf'), )
+        self.counts: dict[tuple[str, ...], list[int]] = dict()
+        self.sums: dict[tuple[str, ...], float] = dict()
+
+    def observe(self, value: float, **labels: object) -> None:
+        key = self._key(labels)
+        index = bisect_left(self.buckets, value)
+        with self.lock:
+            counts = self.counts.get(key)
+            if counts is None:
+                counts = self.counts[key] = [0] * len(self.buckets)
+            counts[index] += 1
+            self.sums[key] = self.sums.get(key, 0.) + value
+
+    def get(self, **labels: object) -> float:
+        """ Amount of observations """
+        return sum(self.counts.get(self._key(labels), ()))
+
+    def get_sum(self, **labels: object) -> float:
+        return self.sums.get(self._key(labels), 0.)
+
+    def clear(self) -> None:
+        with self.lock:
+            self.counts.clear()
+            self.sums.clear()
+
+    def samples(self, extra: str = '') -> Iterable[str]:
+        for key, counts in sorted(self.counts.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                labels = _format_labels(self.label_names, key, extra, f'le="{_format_value(bound)}"')
+                yield f"{self.name}_bucket{labels} {cumulative}"
+            labels = _format_labels(self.label_names, key, extra)
+            yield f"{self.name}_sum{labels} {_format_value(self.sums[key])}"
+            yield f"{self.name}_count{labels} {cumulative}"
+
+
+def render(source: str | None = None) -> str:
+    """ All registered metrics in Prometheus text format
+    :param source: Value of `source` label added to every sample
+    """
+    extra = '' if source is None else f'source="{source}"'
+    return '\n'.join(metric.render(extra) for metric in REGISTRY) + '\n'
+
+
+def publish(folder: Path, source: str) -> None:
+    """ Writes all registered metrics to textfile `source`.prom of folder
+    File is replaced atomically, so collect() never reads half-written one
+    :param source: Name of process (the same on restart, so files don't pile up)
+    """
+    folder.mkdir(parents=True, exist_ok=True)
+    path = folder / f'{source}.prom'
+    temporary = path.with_suffix(f'.{getpid()}.tmp')
+    temporary.write_text(render(source), encoding='utf-8')
+    temporary.replace(path)
+
+
+def collect(folder: Path, source: str) -> str:
+    """ Metrics of this process merged with textfiles published to folder
+    Samples of the same metric are grouped under single HELP/TYPE,
+    as Prometheus rejects repeated metric families
+    :param source: Value of `source` label of this process metrics
+    """
+    texts = [render(source)]
+    if folder.is_dir():
+        for path in sorted(folder.glob('*.prom')):
+            texts.append(path.read_text(encoding='utf-8'))
+
+    families: dict[str, list[str]] = dict()
+    for text in texts:
+        family: list[str] | None = None
+        for line in text.splitlines():
+            if not line:
+                continue
+            if line.startswith('# HELP '):
+                name = line.split(' ', 3)[2]
+                family = families.get(name)
+                if family is None:
+                    family = families[name] = [line]
+            elif line.startswith('# TYPE '):
+                assert family is not None
+                if len(family) == 1:
+                    family.append(line)
+            else:
+                assert family is not None
+                family.append(line)
+    return '\n'.join('\n'.join(i) for i in families.values()) + '\n'
@@ -4,11 +4,16 @@ from django.db.models import (
     CharField,
     DateField,
     ForeignKey,
+    OneToOneField,
     FloatField,
+    JSONField,
+    PositiveSmallIntegerField,
+    TextChoices,
+    TextField,
     CASCADE
 )
 
-__all__ = ('CurrencyInfo', 'CurrencyRate')
+__all__ = ('CurrencyInfo', 'CurrencyRate', 'BackfillTask', 'RateCoverage')
 
 class CurrencyInfo(Model):
     number = IntegerField(unique=True, primary_key=True)
@@ -30,3 +35,33 @@ class CurrencyRate(Model):
 
     class Meta:
         unique_together = ['currencyInfo', 'date']
+
+class BackfillTask(Model):
+    """ Single (currency, period) unit of work of parallel backfill queue """
+    class Status(TextChoices):
+        PENDING = 'pending'
+        RUNNING = 'running'
+        DONE = 'done'
+        FAILED = 'failed'
+
+    currencyInfo = ForeignKey(CurrencyInfo, on_delete=CASCADE, null=False)
+    date_from = DateField(null=False)
+    date_to = DateField(null=False)
+    status = CharField(max_length=7, choices=Status.choices, default=Status.PENDING, db_index=True)
+    attempts = PositiveSmallIntegerField(default=0)
+    worker = IntegerField(null=True)
+    error = TextField(blank=True, default='')
+
+    def __str__(self) -> str:
+        return f"{self.currencyInfo.name} {self.date_from}->{self.date_to} ({self.status})"
+
+    class Meta:
+        unique_together = ['currencyInfo', 'date_from']
+
+class RateCoverage(Model):
+    """ Run-length set of downloaded days of currency (see coverage module) """
+    currencyInfo = OneToOneField(CurrencyInfo, on_delete=CASCADE, null=False, primary_key=True)
+    runs = JSONField(default=list)
+
+    def __str__(self) -> str:
+        return f"{self.currencyInfo.name} coverage ({len(self.runs)} runs)"
@@ -1,27 +1,71 @@
-from typing import Generator, NamedTuple
+from typing import Generator, NamedTuple, TypeVar
 from logging import getLogger
 from threading import Thread
 from datetime import date
 from dateutil.relativedelta import relativedelta
 from time import perf_counter, sleep
 
-from django.db.models import Max, Min
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Max, Min, Model
 import requests
 import bs4
 
-from .forms import DatesForm
 from .models import *
 from .apps import CurrencyConfig
+from .metrics import Counter, Gauge, Histogram
+from . import coverage, markers
 
 __all__ = ('Updater', )
 
+FINMARKET_URL: str = 'https://www.finmarket.ru'
 URL_PERIOD: str = (
-    'https://www.finmarket.ru/currency/rates/?'
+    FINMARKET_URL + '/currency/rates/?'
     'id=10148&pv=1&cur={number}&bd={fromDay}&bm={fromMonth}&by={fromYear}'
     '&ed={toDay}&em={toMonth}&ey={toYear}'
 )
 URL_DAY: str = (
-    'https://www.finmarket.ru/currency/rates/?id=10148&bd={day}&bm={month}&by={year}'
+    FINMARKET_URL + '/currency/rates/?id=10148&bd={day}&bm={month}&by={year}'
+)
+URL_BANKNOTES: str = FINMARKET_URL + '/currency/banknotes/'
+REQUEST_ATTEMPTS: int = 3
+# (connect, read) seconds. Without timeout stalled connection blocks updater forever
+REQUEST_TIMEOUT: tuple[float, float] = (10., 60.)
+
+_T = TypeVar('_T', bound=Model)
+
+REQUEST_SECONDS = Histogram(
+    'updater_request_seconds', "Latency of finmarket page requests", ('status', )
+)
+REQUEST_RETRIES = Counter(
+    'updater_request_retries_total', "Finmarket requests repeated after connection error"
+)
+ANTI_SPAM_SECONDS = Counter(
+    'updater_anti_spam_sleep_seconds_total', "Time spent sleeping between requests"
+)
+HTML_PARSE_SECONDS = Histogram(
+    'updater_html_parse_seconds', "Time spent building BeautifulSoup trees"
+)
+EXTRACT_SECONDS = Histogram(
+    'updater_extract_seconds', "Time spent extracting rows from parsed pages", ('kind', )
+)
+BULK_CREATE_SECONDS = Histogram(
+    'updater_bulk_create_seconds', "Duration of bulk_create() calls", ('mode', )
+)
+BULK_CREATE_ROWS = Counter(
+    'updater_bulk_create_rows_total', "Rows passed to bulk_create()", ('mode', )
+)
+CURRENCY_PROGRESS = Gauge(
+    'updater_currency_progress_ratio', "Part of periods downloaded for currency", ('currency', )
+)
+CURRENCY_ETA = Gauge(
+    'updater_currency_eta_seconds', "Estimated time until currency is downloaded", ('currency', )
+)
+CURRENCIES_DONE = Gauge(
+    'updater_currencies_done', "Currencies downloaded in current update by periods"
+)
+CURRENCIES_TOTAL = Gauge(
+    'updater_currencies_total', "Currencies to download in current update by periods"
 )
 
 class UniqueException(Exception):
@@ -35,7 +79,8 @@ class Updater:
     MINIMUM_DATE = date(year=1992, month=1, day=1)
     __slots__ = (
         'session', 'update_thread', 'delay',
-        'last_request_time', 'logger', 'force_day_update'
+        'last_request_time', 'logger', 'force_day_update',
+        'base_url'
     )
 
     class DayInfo(NamedTuple):
@@ -50,14 +95,21 @@ class Updater:
         rate: float
         change: float
 
-    def __init__(self, sleep_delay: float = 1., force_day_update: bool = False) -> None:
+    def __init__(
+            self,
+            sleep_delay: float = 1.,
+            force_day_update: bool = False,
+            base_url: str = FINMARKET_URL
+        ) -> None:
         assert isinstance(sleep_delay, float)
         assert sleep_delay >= 0
+        assert isinstance(base_url, str)
         self.session = None
         self.update_thread: Thread | None = None
         self.delay = sleep_delay
         self.last_request_time: float = perf_counter()
         self.force_day_update = force_day_update
+        self.base_url = base_url.rstrip('/')
         self.logger = getLogger('db_updater')
 
     @property
@@ -79,6 +131,7 @@ class Updater:
             self.last_request_time = perf_counter()
             return
         sleep(delay)
+        ANTI_SPAM_SECONDS.inc(delay)
         self.last_request_time = perf_counter()
 
     def _update_except(self) -> None:
@@ -95,9 +148,6 @@ class Updater:
             self._init_codes()
             self.logger.info("Finished updating codes")
 
-        values = CurrencyInfo.objects.values_list('number', 'name').all()
-        DatesForm.declared_fields['currencys'].choices = tuple(values)
-
         self._recheck_currencys()
 
     def _update(self) -> None:
@@ -106,21 +156,65 @@ class Updater:
         self.session = requests.Session()
 
         try:
-            self._update_except()
+            with markers.marked(settings.CURRENCY_UPDATING_FOLDER):
+                self._update_except()
         finally:
             assert self.session is not None
             self.session.close()
             self.session = None
 
     def _get_page(self, url: str, allow_redirects: bool = False) -> bs4.BeautifulSoup:
+        page = self._fetch(url, allow_redirects=allow_redirects)
+        start = perf_counter()
+        soup = bs4.BeautifulSoup(page, features='html.parser')
+        HTML_PARSE_SECONDS.observe(perf_counter() - start)
+        return soup
+
+    def _fetch(self, url: str, allow_redirects: bool = False) -> str:
+        return self._request(url, allow_redirects=allow_redirects)[1]
+
+    def _request(self, url: str, allow_redirects: bool = False) -> tuple[int, str]:
+        """ GET with anti-spam delay and retries on connection errors and timeouts
+        :return: Status code and decoded page
+        """
         assert self.session is not None
         assert '{' not in url, "Got unformatted URL"
-        self._anti_spam()
-        with self.session.get(url, allow_redirects=allow_redirects) as response:
-            response.encoding = 'windows-1251'
-            page = response.text
-            soup = bs4.BeautifulSoup(page, features='html.parser')
-            return soup
+        if self.base_url != FINMARKET_URL:
+            # Requests are redirected to mirror (local stand-in server, cache)
+            url = self.base_url + url.removeprefix(FINMARKET_URL)
+        for attempt in range(1, REQUEST_ATTEMPTS+1):
+            self._anti_spam()
+            start = perf_counter()
+            try:
+                response = self.session.get(
+                    url,
+                    allow_redirects=allow_redirects,
+                    timeout=REQUEST_TIMEOUT
+                )
+            except (requests.ConnectionError, requests.Timeout):
+                REQUEST_SECONDS.observe(perf_counter() - start, status='error')
+                if attempt == REQUEST_ATTEMPTS:
+                    raise
+                REQUEST_RETRIES.inc()
+                self.logger.warning(f"Request to {url} failed (attempt {attempt}), retrying")
+                continue
+            with response:
+                response.encoding = 'windows-1251'
+                page = response.text
+            REQUEST_SECONDS.observe(perf_counter() - start, status=response.status_code)
+            return response.status_code, page
+        raise AssertionError("Unreachable")
+
+    def _bulk_create(self, mode: str, objects: list[_T], ignore_conflicts: bool) -> None:
+        assert objects
+        start = perf_counter()
+        type(objects[0]).objects.bulk_create(
+            objects,
+            ignore_conflicts=ignore_conflicts,
+            update_conflicts=False
+        )
+        BULK_CREATE_SECONDS.observe(perf_counter() - start, mode=mode)
+        BULK_CREATE_ROWS.inc(len(objects), mode=mode)
 
     def _recheck_currencys(self) -> None:
         assert hasattr(CurrencyRate, 'currencyInfo')
@@ -208,6 +302,9 @@ class Updater:
         self.logger.info("Updating finished")
 
     def _get_day_info(self, soup: bs4.BeautifulSoup) -> Generator[DayInfo, None, None]:
+        # Time spent by consumer between yields isn't counted
+        elapsed = 0.
+        start = perf_counter()
         tbody = soup.find(name='tbody')
         assert isinstance(tbody, bs4.Tag)
         for i in tbody:
@@ -215,6 +312,7 @@ class Updater:
             amount = int(amount.replace('\xa0', ''))
             rate = float(rate.replace(',', '.')) / amount
             change = float(change.replace(',', '.')) / amount
+            elapsed += perf_counter() - start
             yield self.DayInfo(
                 code=code,
                 name=name,
@@ -222,8 +320,13 @@ class Updater:
                 rate=rate,
                 change=change
             )
+            start = perf_counter()
+        EXTRACT_SECONDS.observe(elapsed + perf_counter() - start, kind='day')
 
     def _get_period_info(self, soup: bs4.BeautifulSoup) -> Generator[PeriodInfo, None, None]:
+        # Time spent by consumer between yields isn't counted
+        elapsed = 0.
+        start = perf_counter()
         table = soup.find(name='table', attrs={'class': 'karramba'})
         assert isinstance(table, bs4.Tag)
         tbody = table.tbody
@@ -235,12 +338,15 @@ class Updater:
             amount = int(amount.text.replace('\xa0', ''))
             rate = float(rate.text.replace(',', '.').replace('\xa0', ''))
             change = float(change.text.replace(',', '.').replace('\xa0', ''))
+            elapsed += perf_counter() - start
             yield self.PeriodInfo(
                 date=rate_date,
                 amount=amount,
                 rate=rate,
                 change=change
             )
+            start = perf_counter()
+        EXTRACT_SECONDS.observe(elapsed + perf_counter() - start, kind='period')
 
     def _init_codes(self) -> None:
         # Getting latest day info
@@ -254,7 +360,7 @@ class Updater:
         available_codes: set[str] = {i.code for i in day_variable}
 
         # Getting all banknotes
-        soup = self._get_page('https://www.finmarket.ru/currency/banknotes/')
+        soup = self._get_page(URL_BANKNOTES)
         table = soup.find(name='table')
         assert isinstance(table, bs4.Tag)
         iterator = iter(table)
@@ -291,52 +397,88 @@ class Updater:
             )
             currency_infos.append(currency_info)
         assert currency_infos, "How currency_infos can be empty?"
-        CurrencyInfo.objects.bulk_create(
-            currency_infos,
-            ignore_conflicts=False,
-            update_conflicts=False
-        )
+        self._bulk_create('codes', currency_infos, ignore_conflicts=False)
 
     def _update_currency(self, currency: CurrencyInfo, dates: list[date]) -> None:
         current_date = iter(dates)
         next_date = iter(dates)
         next(next_date)
         currency_rates: list[CurrencyRate] = []
-        for date_from, date_to in zip(current_date, next_date):
-            self.logger.debug(f"Updating {currency.number} {date_from}->{date_to}")
-            date_from_sec = date_from.toordinal()
-            date_to_sec = date_to.toordinal()
-            date_to -= relativedelta(days=1)
-            if date_from == date_to:
-                continue
-            assert date_to > date_from
-            url = URL_PERIOD.format(
-                number=currency.number_url,
-                fromDay=date_from.day,
-                fromMonth=date_from.month,
-                fromYear=date_from.year,
-                toDay=date_to.day,
-                toMonth=date_to.month,
-                toYear=date_to.year
+        spans: list[tuple[date, date]] = []
+        periods_total = len(dates) - 1
+        started = perf_counter()
+        CURRENCY_PROGRESS.set(0., currency=currency.code)
+        for periods_done, (date_from, date_to) in enumerate(zip(current_date, next_date), 1):
+            currency_rates.extend(self._get_period_rates(currency, date_from, date_to))
+            span = self.period_span(date_from, date_to)
+            if span is not None:
+                spans.append(span)
+            elapsed = perf_counter() - started
+            CURRENCY_PROGRESS.set(periods_done / periods_total, currency=currency.code)
+            CURRENCY_ETA.set(
+                elapsed / periods_done * (periods_total - periods_done),
+                currency=currency.code
             )
-            soup = self._get_page(url)
-            for period in self._get_period_info(soup):
-                assert date_from_sec <= period.date.toordinal() <= date_to_sec, (
-                    "period date received from _get_period_info() is not in range: "
-                    f"{date_from} <= {period.date} <= {date_to}"
-                )
-                currency_rate = CurrencyRate(
-                    currencyInfo=currency,
-                    date=period.date,
-                    value=period.rate
-                )
-                currency_rates.append(currency_rate)
         assert currency_rates, "How currency_rates can be empty?"
-        CurrencyRate.objects.bulk_create(
-            currency_rates,
-            ignore_conflicts=False,
-            update_conflicts=False
+        with transaction.atomic():
+            self._bulk_create('period', currency_rates, ignore_conflicts=False)
+            coverage.record((currency.number, ), spans)
+        CURRENCY_PROGRESS.set(1., currency=currency.code)
+        CURRENCY_ETA.set(0., currency=currency.code)
+
+    def _get_period_rates(
+            self,
+            currency: CurrencyInfo,
+            date_from: date,
+            date_to: date
+        ) -> list[CurrencyRate]:
+        """ Downloads rates of single period from date_periods()
+        :param currency: Currency to download
+        :param date_from: Period start
+        :param date_to: Next period start
+        :return: Unsaved CurrencyRate objects
+        """
+        self.logger.debug(f"Updating {currency.number} {date_from}->{date_to}")
+        date_from_sec = date_from.toordinal()
+        date_to_sec = date_to.toordinal()
+        span = self.period_span(date_from, date_to)
+        if span is None:
+            return []
+        date_to = span[1]
+        url = URL_PERIOD.format(
+            number=currency.number_url,
+            fromDay=date_from.day,
+            fromMonth=date_from.month,
+            fromYear=date_from.year,
+            toDay=date_to.day,
+            toMonth=date_to.month,
+            toYear=date_to.year
         )
+        soup = self._get_page(url)
+        currency_rates: list[CurrencyRate] = []
+        for period in self._get_period_info(soup):
+            assert date_from_sec <= period.date.toordinal() <= date_to_sec, (
+                "period date received from _get_period_info() is not in range: "
+                f"{date_from} <= {period.date} <= {date_to}"
+            )
+            currency_rate = CurrencyRate(
+                currencyInfo=currency,
+                date=period.date,
+                value=period.rate
+            )
+            currency_rates.append(currency_rate)
+        return currency_rates
+
+    @staticmethod
+    def period_span(date_from: date, date_to: date) -> tuple[date, date] | None:
+        """ Days requested by _get_period_rates() for pair of date_periods() dates
+        :return: Both dates inclusive, None if nothing is requested
+        """
+        date_to -= relativedelta(days=1)
+        if date_from == date_to:
+            return None
+        assert date_to > date_from
+        return date_from, date_to
 
     @staticmethod
     def date_periods(from_date: date, to_date: date | None = None) -> list[date]:
@@ -383,12 +525,15 @@ class Updater:
 
         date_ranges = self.date_periods(from_date)
         self.logger.info(f"Updating from {date_ranges[0]} to {date_ranges[-1]}")
+        CURRENCIES_TOTAL.set(len(ids))
+        CURRENCIES_DONE.set(0)
         for id in ids:
             assert isinstance(id, int)
             self._update_currency(
                 currency=CurrencyInfo.objects.get(pk=id),
                 dates=date_ranges
             )
+            CURRENCIES_DONE.inc()
 
     def _update_by_days(self, date_starting: date, date_target: date) -> None:
         assert isinstance(date_starting, date)
@@ -416,10 +561,13 @@ class Updater:
                     value=currency.rate/currency.amount
                 )
                 currency_rates.append(currency_rate)
-            CurrencyRate.objects.bulk_create(
-                currency_rates,
-                ignore_conflicts=True,
-                update_conflicts=False
-            )
+            with transaction.atomic():
+                if currency_rates:
+                    self._bulk_create('day', currency_rates, ignore_conflicts=True)
+                # Page of the day is downloaded, so the day is checked for every currency
+                coverage.record(
+                    CurrencyInfo.objects.values_list('number', flat=True),
+                    ((date_starting, date_starting), )
+                )
             currency_rates.clear()
             date_starting += relativedelta(days=1)
@@ -0,0 +1,135 @@
+"""
+Opt-in request profiling
+
+Enabled for every request by CURRENCY_PROFILING setting, or for single request
+by X-Profile header when CURRENCY_PROFILING_HEADER setting is true (defaults to DEBUG).
+Profiled responses get Server-Timing header, samples are kept in ring buffer SAMPLES
+"""
+from collections import deque
+from contextlib import contextmanager, nullcontext
+from threading import Lock
+from time import perf_counter
+from datetime import datetime
+from typing import Any, Callable, ContextManager, Iterator
+
+from django.conf import settings
+from django.db import connection
+from django.http import HttpRequest, HttpResponse
+
+__all__ = ('ProfilingMiddleware', 'Profile', 'stage', 'samples')
+
+HEADER: str = 'X-Profile'
+SAMPLES: deque[dict[str, Any]] = deque(maxlen=getattr(settings, 'CURRENCY_PROFILING_SAMPLES', 500))
+_samples_lock = Lock()
+
+
+class Profile:
+    __slots__ = ('queries', 'sql_total', 'sql_max', 'sql_slowest', 'sql_in_stages', 'stages')
+
+    def __init__(self) -> None:
+        self.queries: int = 0
+        self.sql_total: float = 0.
+        self.sql_max: float = 0.
+        self.sql_slowest: str = ''
+        # cursor.execute() time spent inside stages, it's already part of their duration
+        self.sql_in_stages: float = 0.
+        self.stages: dict[str, float] = dict()
+
+    def execute_wrapper(self, execute, sql, params, many, context):
+        start = perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = perf_counter() - start
+            self.queries += 1
+            self.sql_total += duration
+            if duration >= self.sql_max:
+                self.sql_max = duration
+                self.sql_slowest = sql
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        start = perf_counter()
+        sql_start = self.sql_total
+        try:
+            yield
+        finally:
+            self.stages[name] = self.stages.get(name, 0.) + perf_counter() - start
+            self.sql_in_stages += self.sql_total - sql_start
+
+
+def stage(request: HttpRequest, name: str) -> ContextManager[None]:
+    """ Measures block as named stage of request profile (no-op if request isn't profiled) """
+    profile: Profile | None = getattr(request, 'profile', None)
+    if profile is None:
+        return nullcontext()
+    return profile.stage(name)
+
+
+def _resize(size: int) -> None:
+    """ Applies CURRENCY_PROFILING_SAMPLES changed after import (keeps newest samples) """
+    global SAMPLES
+    assert size > 0
+    with _samples_lock:
+        if SAMPLES.maxlen != size:
+            SAMPLES = deque(SAMPLES, maxlen=size)
+
+
+def samples() -> list[dict[str, Any]]:
+    with _samples_lock:
+        return list(SAMPLES)
+
+
+class ProfilingMiddleware:
+    __slots__ = ('get_response', 'always', 'by_header')
+
+    def __init__(self, get_response: Callable[[HttpRequest], HttpResponse]) -> None:
+        self.get_response = get_response
+        self.always: bool = getattr(settings, 'CURRENCY_PROFILING', False)
+        self.by_header: bool = getattr(settings, 'CURRENCY_PROFILING_HEADER', settings.DEBUG)
+        _resize(getattr(settings, 'CURRENCY_PROFILING_SAMPLES', 500))
+
+    def __call__(self, request: HttpRequest) -> HttpResponse:
+        if not (self.always or (self.by_header and HEADER in request.headers)):
+            return self.get_response(request)
+
+        profile = Profile()
+        request.profile = profile  # type: ignore[attr-defined]
+        start = perf_counter()
+        with connection.execute_wrapper(profile.execute_wrapper):
+            response = self.get_response(request)
+        total = perf_counter() - start
+
+        size = None if response.streaming else len(response.content)
+        # sql is cursor.execute() time only: row fetching of lazy querysets isn't seen by
+        # execute wrapper, so views measure it as their own stages (info_fetch: sql-fetch)
+        other = total - profile.sql_total - sum(profile.stages.values()) + profile.sql_in_stages
+        timings = [
+            f'sql;dur={profile.sql_total * 1000:.3f};desc="{profile.queries} queries"',
+            f'sql-max;dur={profile.sql_max * 1000:.3f}',
+            *(
+                f'{name};dur={duration * 1000:.3f}'
+                for name, duration in profile.stages.items()
+            ),
+            f'python;dur={other * 1000:.3f}',
+            f'total;dur={total * 1000:.3f}',
+        ]
+        response['Server-Timing'] = ', '.join(timings)
+
+        sample = {
+            'time': datetime.now().isoformat(),
+            'method': request.method,
+            'path': request.path,
+            'status': response.status_code,
+            'queries': profile.queries,
+            'sql_total_ms': profile.sql_total * 1000,
+            'sql_max_ms': profile.sql_max * 1000,
+            'sql_slowest': profile.sql_slowest,
+            'stages_ms': {name: duration * 1000 for name, duration in profile.stages.items()},
+            'python_ms': other * 1000,
+            'total_ms': total * 1000,
+            'response_bytes': size,
+        }
+        with _samples_lock:
+            SAMPLES.append(sample)
+        return response
@@ -0,0 +1,255 @@
+"""
+Compact snapshot of the rate database
+
+Layout (all integers little-endian):
+    MAGIC, version (uint16)
+    header length (uint32), header (JSON, utf-8)
+    for each currency in header:
+        block length (uint32), block (zlib)
+
+Header holds CurrencyInfo fields, amount of rows and (since version 2)
+coverage runs (see coverage module) of each currency.
+Decompressed block is two columns of equal length: dates as delta-encoded
+ordinals (int32, first one absolute) followed by values (float64).
+Consecutive days give runs of ones, which zlib compresses almost to nothing
+"""
+import json
+import sys
+import zlib
+from array import array
+from datetime import date, datetime
+from pathlib import Path
+from struct import Struct
+from typing import Any, BinaryIO, Iterator
+
+from django.db import connection, transaction
+from django.db.models import Max
+from django.db.models.constants import OnConflict
+
+from .models import *
+from . import coverage
+
+__all__ = ('SnapshotError', 'dump', 'load')
+
+MAGIC: bytes = b'CURSNAP'
+VERSION: int = 2
+BATCH_SIZE: int = 10000
+
+# Fields of currency in header by snapshot version
+HEADER_FIELDS: dict[int, frozenset[str]] = {
+    1: frozenset(('number', 'number_url', 'code', 'name', 'country', 'rows')),
+    2: frozenset(('number', 'number_url', 'code', 'name', 'country', 'rows', 'coverage')),
+}
+
+_version = Struct('<H')
+_length = Struct('<I')
+
+
+class SnapshotError(Exception):
+    pass
+
+
+def _little_endian(column: array) -> array:
+    if sys.byteorder == 'big':
+        column.byteswap()
+    return column
+
+
+def _encode(rows: list[tuple[date, float]]) -> bytes:
+    ordinals = array('i')
+    values = array('d')
+    previous = 0
+    for rate_date, value in rows:
+        ordinal = rate_date.toordinal()
+        ordinals.append(ordinal - previous)
+        values.append(value)
+        previous = ordinal
+    payload = _little_endian(ordinals).tobytes() + _little_endian(values).tobytes()
+    return zlib.compress(payload, level=9)
+
+
+def _decode(block: bytes, rows: int) -> Iterator[tuple[date, float]]:
+    try:
+        payload = zlib.decompress(block)
+    except zlib.error as e:
+        raise SnapshotError(f"Corrupted block: {e}") from e
+    ordinals = array('i')
+    values = array('d')
+    split = rows * ordinals.itemsize
+    if len(payload) != split + rows * values.itemsize:
+        raise SnapshotError("Block size doesn't match amount of rows in header")
+    ordinals.frombytes(payload[:split])
+    values.frombytes(payload[split:])
+    ordinal = 0
+    for delta, value in zip(_little_endian(ordinals), _little_endian(values)):
+        ordinal += delta
+        yield date.fromordinal(ordinal), value
+
+
+def _insert_sql() -> str:
+    """ INSERT ignoring conflicts in dialect of current database
+    Used instead of bulk_create(), which spends most of import time building model
+    instances and preparing each field value
+    """
+    ops = connection.ops
+    fields = [CurrencyRate._meta.get_field(name) for name in ('currencyInfo', 'date', 'value')]
+    columns = ', '.join(ops.quote_name(field.column) for field in fields)
+    return (
+        f"{ops.insert_statement(on_conflict=OnConflict.IGNORE)} "
+        f"{ops.quote_name(CurrencyRate._meta.db_table)} ({columns}) VALUES (%s, %s, %s) "
+        f"{ops.on_conflict_suffix_sql(fields, OnConflict.IGNORE, None, None)}"
+    )
+
+
+def _read(file: BinaryIO, size: int) -> bytes:
+    data = file.read(size)
+    if len(data) != size:
+        raise SnapshotError("Unexpected end of snapshot")
+    return data
+
+
+def _valid_runs(runs: Any) -> bool:
+    return isinstance(runs, list) and all(
+        isinstance(run, list) and len(run) == 2
+        and all(isinstance(i, int) for i in run) and run[0] <= run[1]
+        for run in runs
+    )
+
+
+def _parse_header(data: bytes, version: int) -> list[dict[str, Any]]:
+    """ Currencies of snapshot header, checked to have every field dumped by version """
+    try:
+        header = json.loads(data)
+        currencies: list[dict[str, Any]] = header['currencies']
+        for currency in currencies:
+            if (
+                set(currency) != HEADER_FIELDS[version]
+                or not isinstance(currency['rows'], int)
+                or ('coverage' in currency and not _valid_runs(currency['coverage']))
+            ):
+                raise SnapshotError(f"Bad currency in snapshot header: {currency}")
+    except (UnicodeDecodeError, json.JSONDecodeError) as e:
+        raise SnapshotError(f"Snapshot header isn't valid JSON: {e}") from e
+    except (KeyError, TypeError) as e:
+        raise SnapshotError(f"Bad snapshot header: {e!r}") from e
+    return currencies
+
+
+def dump(path: Path) -> dict[str, Any]:
+    """ Writes all CurrencyInfo/CurrencyRate to snapshot
+    :param path: Snapshot file
+    :return: Statistics: amount of currencies and rows, file size
+    """
+    currencies: list[dict[str, Any]] = []
+    blocks: list[bytes] = []
+    runs: dict[int, coverage.Runs] = dict(RateCoverage.objects.values_list('currencyInfo', 'runs'))
+    for currency in CurrencyInfo.objects.order_by('number'):
+        rows = list(CurrencyRate.objects
+            .filter(currencyInfo=currency)
+            .order_by('date')
+            .values_list('date', 'value')
+            .iterator(chunk_size=BATCH_SIZE)
+        )
+        currencies.append({
+            'number': currency.number,
+            'number_url': currency.number_url,
+            'code': currency.code,
+            'name': currency.name,
+            'country': currency.country,
+            'rows': len(rows),
+            'coverage': runs.get(currency.number, []),
+        })
+        blocks.append(_encode(rows))
+
+    header = json.dumps({
+        'created': datetime.now().isoformat(),
+        'currencies': currencies,
+    }).encode('utf-8')
+    with path.open('wb') as file:
+        file.write(MAGIC)
+        file.write(_version.pack(VERSION))
+        file.write(_length.pack(len(header)))
+        file.write(header)
+        for block in blocks:
+            file.write(_length.pack(len(block)))
+            file.write(block)
+    return {
+        'currencies': len(currencies),
+        'rows': sum(i['rows'] for i in currencies),
+        'bytes': path.stat().st_size,
+    }
+
+
+def load(path: Path, incremental: bool = False) -> dict[str, Any]:
+    """ Inserts snapshot contents into database
+    :param path: Snapshot file
+    :param incremental: Insert only rows newer than latest stored rate of each
+        currency. Otherwise every row is inserted, existing ones are skipped
+    :return: Statistics: amount of currencies, rows in snapshot and rows passed to database
+    """
+    with path.open('rb') as file:
+        if file.read(len(MAGIC)) != MAGIC:
+            raise SnapshotError(f"{path} is not a currency snapshot")
+        version, = _version.unpack(_read(file, _version.size))
+        if version not in HEADER_FIELDS:
+            raise SnapshotError(f"Unsupported snapshot version {version} (expected {VERSION})")
+        header_length, = _length.unpack(_read(file, _length.size))
+        currencies = _parse_header(_read(file, header_length), version)
+        CurrencyInfo.objects.bulk_create(
+            [
+                CurrencyInfo(**{k: v for k, v in i.items() if k not in {'rows', 'coverage'}})
+                for i in currencies
+            ],
+            ignore_conflicts=True
+        )
+        max_dates: dict[int, date] = {}
+        if incremental:
+            max_dates = {
+                i['currencyInfo']: i['date_max']
+                for i in CurrencyRate.objects.values('currencyInfo').annotate(date_max=Max('date'))
+            }
+
+        sql = _insert_sql()
+        adapt_date = connection.ops.adapt_datefield_value
+        inserted = 0
+        for currency in currencies:
+            block_length, = _length.unpack(_read(file, _length.size))
+            block = _read(file, block_length)
+            max_date = max_dates.get(currency['number'])
+            currency_rates: list[tuple[int, Any, float]] = []
+            ordinals: list[int] = []
+            with transaction.atomic(), connection.cursor() as cursor:
+                for rate_date, value in _decode(block, currency['rows']):
+                    if max_date is not None and rate_date <= max_date:
+                        continue
+                    ordinals.append(rate_date.toordinal())
+                    currency_rates.append((currency['number'], adapt_date(rate_date), value))
+                    if len(currency_rates) >= BATCH_SIZE:
+                        cursor.executemany(sql, currency_rates)
+                        inserted += len(currency_rates)
+                        currency_rates.clear()
+                if currency_rates:
+                    cursor.executemany(sql, currency_rates)
+                    inserted += len(currency_rates)
+                if 'coverage' in currency:
+                    # Coverage of source database, without days skipped by incremental import
+                    first = 0 if max_date is None else max_date.toordinal() + 1
+                    runs = [
+                        [max(start, first), end]
+                        for start, end in currency['coverage']
+                        if end >= first
+                    ]
+                else:
+                    # Version 1 doesn't store coverage, so spans of rows passed to
+                    # database are covered (holidays guessed as in coverage.rebuild())
+                    runs = coverage.runs_from_ordinals(ordinals)
+                # Merged, existing runs stay as they are
+                coverage.record(
+                    (currency['number'], ),
+                    ((date.fromordinal(start), date.fromordinal(end)) for start, end in runs)
+                )
+    return {
+        'currencies': len(currencies),
+        'rows': sum(i['rows'] for i in currencies),
+        'inserted': inserted,
+    }
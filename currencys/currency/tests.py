@@ -1,3 +1,706 @@
-from django.test import TestCase
+import json
+import os
+import struct
+import subprocess
+import sys
+from datetime import date, timedelta
+from io import StringIO
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from unittest import mock
 
-# Create your tests here.
+import requests
+from django.apps import apps
+from django.conf import settings
+from django.core.management import CommandError, call_command
+from django.db.models import QuerySet
+from django.db import connection
+from django.http import HttpRequest, HttpResponse
+from django.test import Client, RequestFactory, SimpleTestCase, TestCase, override_settings
+
+from .models import *
+from . import backfill, coverage, markers, metrics, profiling, snapshot
+from .apps import CurrencyConfig
+from .benchmark import generator, scenarios
+from .benchmark.server import FinmarketStandIn
+from .parser import URL_BANKNOTES, URL_PERIOD, Updater
+
+
+def _ordinals(*spans: tuple[date, date]) -> list[tuple[int, int]]:
+    return [(start.toordinal(), end.toordinal()) for start, end in spans]
+
+
+class CoverageRunsTests(SimpleTestCase):
+    def test_add_span_merges_overlapping_and_adjacent(self) -> None:
+        runs = coverage.add_span([], 10, 20)
+        self.assertEqual(runs, [[10, 20]])
+        runs = coverage.add_span(runs, 30, 40)
+        self.assertEqual(runs, [[10, 20], [30, 40]])
+        # Adjacent on both sides: all three become single run
+        self.assertEqual(coverage.add_span(runs, 21, 29), [[10, 40]])
+        self.assertEqual(coverage.add_span(runs, 15, 35), [[10, 40]])
+        self.assertEqual(coverage.add_span(runs, 1, 5), [[1, 5], [10, 20], [30, 40]])
+        self.assertEqual(coverage.add_span(runs, 50, 60), [[10, 20], [30, 40], [50, 60]])
+        self.assertEqual(coverage.add_span(runs, 22, 28), [[10, 20], [22, 28], [30, 40]])
+
+    def test_add_span_keeps_input(self) -> None:
+        runs = [[10, 20]]
+        coverage.add_span(runs, 21, 30)
+        self.assertEqual(runs, [[10, 20]])
+
+    def test_missing(self) -> None:
+        runs = [[10, 20], [30, 40]]
+        self.assertEqual(coverage.missing(runs, 1, 50), [(1, 9), (21, 29), (41, 50)])
+        self.assertEqual(coverage.missing(runs, 12, 35), [(21, 29)])
+        self.assertEqual(coverage.missing(runs, 10, 20), [])
+        self.assertEqual(coverage.missing([], 5, 7), [(5, 7)])
+
+    def test_plan_requests_joins_close_spans(self) -> None:
+        self.assertEqual(coverage.plan_requests([(1, 5), (8, 9)], max_days=10), [(1, 9)])
+        self.assertEqual(coverage.plan_requests([(8, 9), (1, 5)], max_days=10), [(1, 9)])
+        self.assertEqual(coverage.plan_requests([(1, 5), (20, 25)], max_days=10), [(1, 5), (20, 25)])
+
+    def test_plan_requests_splits_long_spans(self) -> None:
+        requests = coverage.plan_requests([(1, 25)], max_days=10)
+        self.assertEqual(requests, [(1, 10), (11, 20), (21, 25)])
+        self.assertTrue(all(end - start + 1 <= 10 for start, end in requests))
+
+    def test_runs_from_ordinals(self) -> None:
+        self.assertEqual(coverage.runs_from_ordinals([1, 2, 3, 10, 30], tolerance=6), [[1, 10], [30, 30]])
+        self.assertEqual(coverage.runs_from_ordinals([], tolerance=6), [])
+
+
+class CoverageTests(TestCase):
+    def setUp(self) -> None:
+        self.currency = CurrencyInfo.objects.create(
+            number=1, number_url=1, code='AAA', name="A", country="A"
+        )
+        CurrencyInfo.objects.create(number=2, number_url=2, code='BBB', name="B", country="B")
+
+    def test_record_merges_into_existing_runs(self) -> None:
+        coverage.record((1, ), ((date(2020, 1, 1), date(2020, 1, 10)), ))
+        coverage.record((1, ), ((date(2020, 1, 11), date(2020, 1, 20)), ))
+        self.assertEqual(
+            RateCoverage.objects.get(currencyInfo_id=1).runs,
+            [list(i) for i in _ordinals((date(2020, 1, 1), date(2020, 1, 20)))]
+        )
+        self.assertEqual(coverage.uncovered(), [2])
+
+    def test_gaps(self) -> None:
+        coverage.record((1, ), (
+            (date(2020, 1, 1), date(2020, 1, 10)),
+            (date(2020, 1, 20), date(2020, 1, 31)),
+        ))
+        self.assertEqual(
+            coverage.gaps(1, to_date=date(2020, 2, 5)),
+            [(date(2020, 1, 11), date(2020, 1, 19)), (date(2020, 2, 1), date(2020, 2, 5))]
+        )
+        # Default end is the last day updater downloads, not yesterday
+        last = coverage.gaps(1)[-1]
+        self.assertEqual(last[1], date.today() - timedelta(days=2))
+        coverage.record((1, ), ((date(2020, 2, 1), coverage.last_fetched_day()), ))
+        self.assertEqual(coverage.gaps(1), [(date(2020, 1, 11), date(2020, 1, 19))])
+
+    def test_gaps_of_uncovered_currency(self) -> None:
+        from .parser import Updater
+        self.assertEqual(
+            coverage.gaps(2, to_date=date(2000, 1, 1)),
+            [(Updater.MINIMUM_DATE, date(2000, 1, 1))]
+        )
+
+    def test_plan_skips_uncovered(self) -> None:
+        coverage.record((1, ), (
+            (date(2020, 1, 1), date(2020, 1, 10)),
+            (date(2020, 1, 20), coverage.last_fetched_day()),
+        ))
+        repair = [(date(2020, 1, 11), date(2020, 1, 19))]
+        self.assertEqual(coverage.plan(), {1: repair})
+        self.assertEqual(
+            coverage.plan(with_uncovered=True)[2][0],
+            (Updater.MINIMUM_DATE, Updater.MINIMUM_DATE + timedelta(days=coverage.MAX_REQUEST_DAYS - 1))
+        )
+        self.assertEqual(
+            coverage.plan(from_date=date(2020, 1, 1), to_date=date(2020, 1, 31)),
+            {1: repair, 2: [(date(2020, 1, 1), date(2020, 1, 31))]}
+        )
+
+        output = StringIO()
+        call_command('repair_gaps', '--dry-run', stdout=output)
+        self.assertIn("Skipping 1 currencies without coverage", output.getvalue())
+        self.assertIn("1 requests for 1 currencies planned", output.getvalue())
+        # Currency 2 has no rates, so after rebuild it really needs whole history
+        output = StringIO()
+        call_command('repair_gaps', '--dry-run', '--rebuild', stdout=output)
+        self.assertNotIn("Skipping", output.getvalue())
+        self.assertIn("2: 1992-01-01->", output.getvalue())
+
+    def test_rebuild(self) -> None:
+        CurrencyRate.objects.bulk_create([
+            CurrencyRate(currencyInfo=self.currency, date=date(2020, 1, day), value=1.)
+            for day in (1, 2, 3, 6, 25)
+        ])
+        coverage.rebuild((1, ), tolerance=3)
+        self.assertEqual(
+            RateCoverage.objects.get(currencyInfo_id=1).runs,
+            [list(i) for i in _ordinals(
+                (date(2020, 1, 1), date(2020, 1, 6)),
+                (date(2020, 1, 25), date(2020, 1, 25)),
+            )]
+        )
+
+
+class SnapshotEncodingTests(SimpleTestCase):
+    def test_round_trip(self) -> None:
+        rows = [
+            (date(1992, 7, 1), 125.25),
+            (date(1992, 7, 2), 130.),
+            (date(1992, 7, 10), 0.1),
+            (date(2024, 2, 29), 91.0001),
+        ]
+        self.assertEqual(list(snapshot._decode(snapshot._encode(rows), len(rows))), rows)
+        self.assertEqual(list(snapshot._decode(snapshot._encode([]), 0)), [])
+
+    def test_rows_mismatch(self) -> None:
+        block = snapshot._encode([(date(2020, 1, 1), 1.)])
+        with self.assertRaises(snapshot.SnapshotError):
+            list(snapshot._decode(block, 2))
+
+    def test_corrupted_block(self) -> None:
+        block = snapshot._encode([(date(2020, 1, 1), 1.)])
+        with self.assertRaises(snapshot.SnapshotError):
+            list(snapshot._decode(block[:-4] + b'\0\0\0\0', 1))
+        with self.assertRaises(snapshot.SnapshotError):
+            list(snapshot._decode(b'not zlib', 1))
+
+
+class SnapshotTests(TestCase):
+    def setUp(self) -> None:
+        self.folder = TemporaryDirectory()
+        self.path = Path(self.folder.name) / 'rates.cursnap'
+        self.currency = CurrencyInfo.objects.create(
+            number=1, number_url=10, code='AAA', name="A", country="A"
+        )
+        CurrencyInfo.objects.create(number=2, number_url=20, code='BBB', name="B", country="B")
+        # 6th and 7th are real gap, not holidays
+        CurrencyRate.objects.bulk_create([
+            CurrencyRate(currencyInfo=self.currency, date=date(2020, 1, day), value=day / 10)
+            for day in (1, 2, 3, 4, 5, 8, 9, 10)
+        ])
+        self.runs = [list(i) for i in _ordinals(
+            (date(2020, 1, 1), date(2020, 1, 5)),
+            (date(2020, 1, 8), date(2020, 1, 10)),
+        )]
+        RateCoverage.objects.create(currencyInfo=self.currency, runs=self.runs)
+
+    def tearDown(self) -> None:
+        self.folder.cleanup()
+
+    def _stored(self) -> list[tuple[int, date, float]]:
+        return list(CurrencyRate.objects
+            .order_by('currencyInfo', 'date')
+            .values_list('currencyInfo', 'date', 'value')
+        )
+
+    def test_dump_load(self) -> None:
+        stored = self._stored()
+        stats = snapshot.dump(self.path)
+        self.assertEqual((stats['currencies'], stats['rows']), (2, 8))
+        CurrencyRate.objects.all().delete()
+        CurrencyInfo.objects.all().delete()
+
+        stats = snapshot.load(self.path)
+        self.assertEqual((stats['currencies'], stats['rows'], stats['inserted']), (2, 8, 8))
+        self.assertEqual(self._stored(), stored)
+        self.assertEqual(CurrencyInfo.objects.get(number=2).number_url, 20)
+        # Exact coverage of source, gap isn't guessed to be holidays
+        self.assertEqual(RateCoverage.objects.get(currencyInfo_id=1).runs, self.runs)
+        self.assertEqual(coverage.uncovered(), [2])
+        # Loading again passes every row to database, none is duplicated
+        snapshot.load(self.path)
+        self.assertEqual(self._stored(), stored)
+
+    def test_load_keeps_existing_coverage(self) -> None:
+        snapshot.dump(self.path)
+        coverage.record((1, ), ((date(2019, 1, 1), date(2020, 1, 31)), ))
+        snapshot.load(self.path)
+        self.assertEqual(
+            RateCoverage.objects.get(currencyInfo_id=1).runs,
+            [list(i) for i in _ordinals((date(2019, 1, 1), date(2020, 1, 31)))]
+        )
+
+    def test_incremental(self) -> None:
+        CurrencyRate.objects.bulk_create([
+            CurrencyRate(currencyInfo=self.currency, date=date(2020, 2, day), value=2.)
+            for day in range(1, 6)
+        ])
+        coverage.record((1, ), ((date(2020, 2, 1), date(2020, 2, 5)), ))
+        snapshot.dump(self.path)
+        CurrencyRate.objects.filter(date__gte=date(2020, 1, 5)).delete()
+        RateCoverage.objects.filter(currencyInfo_id=1).update(
+            runs=[list(i) for i in _ordinals((date(2019, 12, 1), date(2020, 1, 4)))]
+        )
+        # Changed value older than latest stored rate must stay as it is
+        CurrencyRate.objects.filter(date=date(2020, 1, 1)).update(value=100.)
+
+        stats = snapshot.load(self.path, incremental=True)
+        self.assertEqual(stats['inserted'], 9)
+        self.assertEqual(CurrencyRate.objects.count(), 13)
+        self.assertEqual(CurrencyRate.objects.get(date=date(2020, 1, 1)).value, 100.)
+        # Source coverage after latest stored rate is merged into existing one
+        self.assertEqual(
+            RateCoverage.objects.get(currencyInfo_id=1).runs,
+            [list(i) for i in _ordinals(
+                (date(2019, 12, 1), date(2020, 1, 5)),
+                (date(2020, 1, 8), date(2020, 1, 10)),
+                (date(2020, 2, 1), date(2020, 2, 5)),
+            )]
+        )
+
+    def test_load_version_1(self) -> None:
+        """ Version 1 has no coverage in header, it's guessed from inserted rows """
+        rows = list(CurrencyRate.objects.order_by('date').values_list('date', 'value'))
+        header = json.dumps({'currencies': [{
+            'number': 1, 'number_url': 10, 'code': 'AAA', 'name': "A", 'country': "A", 'rows': len(rows)
+        }]}).encode()
+        block = snapshot._encode(rows)
+        self.path.write_bytes(
+            snapshot.MAGIC + struct.pack('<HI', 1, len(header)) + header
+            + struct.pack('<I', len(block)) + block
+        )
+        CurrencyRate.objects.all().delete()
+        RateCoverage.objects.all().delete()
+
+        self.assertEqual(snapshot.load(self.path)['inserted'], len(rows))
+        self.assertEqual(
+            RateCoverage.objects.get(currencyInfo_id=1).runs,
+            [list(i) for i in _ordinals((date(2020, 1, 1), date(2020, 1, 10)))]
+        )
+
+    def test_bad_files(self) -> None:
+        self.path.write_bytes(b'garbage')
+        with self.assertRaises(snapshot.SnapshotError):
+            snapshot.load(self.path)
+
+        def with_header(header: bytes) -> Path:
+            self.path.write_bytes(
+                snapshot.MAGIC + struct.pack('<HI', snapshot.VERSION, len(header)) + header
+            )
+            return self.path
+
+        bad_coverage = json.dumps({'currencies': [{
+            'number': 3, 'number_url': 3, 'code': 'CCC', 'name': "C", 'country': "C",
+            'rows': 0, 'coverage': [[5, 1]],
+        }]}).encode()
+        for header in (
+                b'{', b'[]', b'{"created": ""}',
+                b'{"currencies": [{"number": 3}]}', bad_coverage
+            ):
+            with self.subTest(header=header), self.assertRaises(snapshot.SnapshotError):
+                snapshot.load(with_header(header))
+
+    def test_import_command_reports_corruption(self) -> None:
+        snapshot.dump(self.path)
+        data = self.path.read_bytes()
+        self.path.write_bytes(data[:-4] + bytes(4))
+        with self.assertRaises(CommandError):
+            call_command('import_snapshot', str(self.path))
+
+
+class BackfillTests(TestCase):
+    def setUp(self) -> None:
+        self.folder = TemporaryDirectory()
+        self.currency = CurrencyInfo.objects.create(
+            number=1, number_url=10, code='AAA', name="A", country="A"
+        )
+        self.tasks = BackfillTask.objects.bulk_create([
+            BackfillTask(currencyInfo=self.currency, date_from=date(2000 + i, 1, 1), date_to=date(2001 + i, 1, 1))
+            for i in range(2)
+        ])
+
+    def tearDown(self) -> None:
+        self.folder.cleanup()
+
+    def test_claim(self) -> None:
+        first = backfill._claim(worker=1)
+        second = backfill._claim(worker=2)
+        assert first is not None and second is not None
+        self.assertEqual((first.pk, first.status, first.worker, first.attempts), (
+            self.tasks[0].pk, BackfillTask.Status.RUNNING, 1, 1
+        ))
+        self.assertEqual(second.pk, self.tasks[1].pk)
+        self.assertIsNone(backfill._claim(worker=3))
+
+    def test_claim_lost_race(self) -> None:
+        """ Task claimed by other worker between select and update is skipped """
+        first = QuerySet.first
+        def first_stolen(queryset: QuerySet):
+            task = first(queryset)
+            if task is not None and task.pk == self.tasks[0].pk:
+                BackfillTask.objects.filter(pk=task.pk).update(status=BackfillTask.Status.RUNNING, worker=2)
+            return task
+        with mock.patch.object(QuerySet, 'first', first_stolen):
+            task = backfill._claim(worker=1)
+        assert task is not None
+        self.assertEqual(task.pk, self.tasks[1].pk)
+        self.assertEqual(BackfillTask.objects.get(pk=self.tasks[0].pk).worker, 2)
+
+    def _work(self) -> None:
+        # Worker closes connections on exit, which would break test transaction
+        with override_settings(CURRENCY_METRICS_FOLDER=Path(self.folder.name)), \
+                mock.patch.object(backfill, 'connections'):
+            backfill._work(0, 0., 'http://127.0.0.1:9', None, None, None)
+
+    def test_failed_after_max_attempts(self) -> None:
+        with mock.patch.object(backfill, '_process', side_effect=ValueError("broken page")) as process:
+            self._work()
+        self.assertEqual(process.call_count, 2 * backfill.MAX_ATTEMPTS)
+        for task in BackfillTask.objects.all():
+            self.assertEqual(task.status, BackfillTask.Status.FAILED)
+            self.assertEqual(task.attempts, backfill.MAX_ATTEMPTS)
+            self.assertIn("broken page", task.error)
+        self.assertTrue((Path(self.folder.name) / 'backfill-0.prom').exists())
+
+        self.assertEqual(backfill.requeue(), 2)
+        self.assertEqual(
+            list(BackfillTask.objects.values_list('status', 'attempts', 'error').distinct()),
+            [(BackfillTask.Status.PENDING, 0, '')]
+        )
+
+    def test_retry_then_done(self) -> None:
+        def process(updater: backfill.ShardedUpdater, task: BackfillTask) -> None:
+            if task.attempts == 1:
+                raise ValueError("timeout")
+            task.status = BackfillTask.Status.DONE
+            task.save(update_fields=('status', ))
+        with mock.patch.object(backfill, '_process', side_effect=process):
+            self._work()
+        self.assertEqual(
+            list(BackfillTask.objects.values_list('status', 'attempts').distinct()),
+            [(BackfillTask.Status.DONE, 2)]
+        )
+
+    def test_enqueue_reset(self) -> None:
+        BackfillTask.objects.update(status=BackfillTask.Status.DONE)
+        self.assertEqual(backfill.enqueue(date(2000, 1, 1), date(2002, 1, 1)), 0)
+        self.assertEqual(backfill.enqueue(date(2000, 1, 1), date(2002, 1, 1), reset=True), 2)
+
+    def test_enqueue_resumes_from_queued_tasks(self) -> None:
+        BackfillTask.objects.all().delete()
+        to_date = date(2020, 1, 1)
+        pending = backfill.enqueue(to_date=to_date)
+        first = BackfillTask.objects.order_by('date_from').first()
+        assert first is not None
+        # First chunk is done, its last rate is a few days before its end (holidays)
+        CurrencyRate.objects.create(
+            currencyInfo=self.currency, date=first.date_to - timedelta(days=3), value=1.
+        )
+        BackfillTask.objects.filter(pk=first.pk).update(status=BackfillTask.Status.DONE)
+
+        self.assertEqual(backfill.enqueue(to_date=to_date), pending - 1)
+        self.assertEqual(BackfillTask.objects.count(), pending)
+        # Later end only adds chunk after the last queued one
+        backfill.enqueue(to_date=to_date + timedelta(days=10))
+        self.assertEqual(BackfillTask.objects.count(), pending + 1)
+        self.assertEqual(
+            BackfillTask.objects.order_by('date_from').last().date_from, to_date
+        )
+
+    def test_release_abandoned(self) -> None:
+        finished = subprocess.run([sys.executable, '-c', 'import os; print(os.getpid())'],
+            capture_output=True, text=True, check=True)
+        BackfillTask.objects.filter(pk=self.tasks[0].pk).update(
+            status=BackfillTask.Status.RUNNING, worker=int(finished.stdout)
+        )
+        # Worker of concurrently running backfill
+        BackfillTask.objects.filter(pk=self.tasks[1].pk).update(
+            status=BackfillTask.Status.RUNNING, worker=os.getpid()
+        )
+        self.assertEqual(backfill.release_abandoned(), 1)
+        self.assertEqual(
+            list(BackfillTask.objects.order_by('pk').values_list('status', flat=True)),
+            [BackfillTask.Status.PENDING, BackfillTask.Status.RUNNING]
+        )
+
+    def test_page_cache_keeps_successful_pages_only(self) -> None:
+        cache = Path(self.folder.name)
+        with FinmarketStandIn(currencies=1) as stand_in:
+            updater = backfill.ShardedUpdater(sleep_delay=0., base_url=stand_in.url, cache_dir=cache)
+            updater.session = requests.Session()
+            try:
+                # Stand-in has no banknotes page and answers 404
+                updater._fetch(URL_BANKNOTES)
+                self.assertEqual(list(cache.iterdir()), [])
+                url = URL_PERIOD.format(
+                    number=10, fromDay=1, fromMonth=1, fromYear=2020, toDay=5, toMonth=1, toYear=2020
+                )
+                page = updater._fetch(url)
+                self.assertEqual(updater._fetch(url), page)
+            finally:
+                updater.session.close()
+            self.assertEqual(stand_in.requests, 2)
+        self.assertEqual([i.name for i in cache.iterdir()], [backfill.page_cache_name(url)])
+
+
+class MetricsTests(SimpleTestCase):
+    def setUp(self) -> None:
+        self.folder = TemporaryDirectory()
+        self.counter = metrics.Counter('test_requests_total', "Requests", ('status', ))
+        self.histogram = metrics.Histogram('test_seconds', "Latency", ('kind', ), buckets=(.5, .1))
+
+    def tearDown(self) -> None:
+        self.folder.cleanup()
+        metrics.REGISTRY.remove(self.counter)
+        metrics.REGISTRY.remove(self.histogram)
+
+    def test_counter(self) -> None:
+        self.counter.inc(status=404)
+        self.counter.inc(2, status=200)
+        self.assertEqual(self.counter.render(), '\n'.join((
+            '# HELP test_requests_total Requests',
+            '# TYPE test_requests_total counter',
+            'test_requests_total{status="200"} 2.0',
+            'test_requests_total{status="404"} 1.0',
+        )))
+        with self.assertRaises(AssertionError):
+            self.counter.inc(-1, status=200)
+        with self.assertRaises(AssertionError):
+            self.counter.inc(other=1)
+        with self.assertRaises(AssertionError):
+            metrics.Counter('test_requests_total', "Duplicate")
+
+    def test_histogram_buckets(self) -> None:
+        # Bounds are inclusive (le), values above last bound go to +Inf
+        for value in (.1, .2, .5, 3.):
+            self.histogram.observe(value, kind='page')
+        self.assertEqual(self.histogram.get(kind='page'), 4)
+        self.assertAlmostEqual(self.histogram.get_sum(kind='page'), 3.8)
+        self.assertEqual(list(self.histogram.samples()), [
+            'test_seconds_bucket{kind="page",le="0.1"} 1',
+            'test_seconds_bucket{kind="page",le="0.5"} 3',
+            'test_seconds_bucket{kind="page",le="+Inf"} 4',
+            'test_seconds_sum{kind="page"} 3.8',
+            'test_seconds_count{kind="page"} 4',
+        ])
+        self.assertEqual(
+            list(self.histogram.samples('source="web"'))[0],
+            'test_seconds_bucket{kind="page",source="web",le="0.1"} 1'
+        )
+
+    def test_collect_merges_published(self) -> None:
+        folder = Path(self.folder.name)
+        self.counter.inc(status=200)
+        metrics.publish(folder, 'update_rates')
+        self.counter.inc(status=200)
+        lines = metrics.collect(folder, source='web').splitlines()
+        self.assertEqual(lines.count('# HELP test_requests_total Requests'), 1)
+        self.assertEqual(lines.count('# TYPE test_requests_total counter'), 1)
+        start = lines.index('# HELP test_requests_total Requests')
+        self.assertEqual(lines[start + 2:start + 4], [
+            'test_requests_total{status="200",source="web"} 2.0',
+            'test_requests_total{status="200",source="update_rates"} 1.0',
+        ])
+        self.assertEqual([i.name for i in folder.iterdir()], ['update_rates.prom'])
+
+
+class UpdateByPeriodsTests(TestCase):
+    def test_against_stand_in(self) -> None:
+        infos = generator.create_infos(2)
+        from_date = date.today() - timedelta(days=900)
+        with FinmarketStandIn(currencies=2) as stand_in:
+            updater = Updater(sleep_delay=0., base_url=stand_in.url)
+            updater.session = requests.Session()
+            try:
+                updater._update_by_periods(from_date=from_date, ids={i.number for i in infos})
+            finally:
+                updater.session.close()
+            self.assertEqual(
+                stand_in.requests,
+                (len(Updater.date_periods(from_date)) - 1) * len(infos)
+            )
+
+        last_day = coverage.last_fetched_day()
+        for info in infos:
+            rates = list(CurrencyRate.objects
+                .filter(currencyInfo=info)
+                .order_by('date')
+                .values_list('date', 'value')
+            )
+            self.assertEqual(len(rates), (last_day - from_date).days + 1)
+            self.assertEqual((rates[0][0], rates[-1][0]), (from_date, last_day))
+            for rate_date, value in rates[::100]:
+                self.assertAlmostEqual(value, generator.synthetic_rate(info.number_url, rate_date), places=4)
+            self.assertEqual(coverage.gaps(info.number), [])
+
+
+class MarkersTests(SimpleTestCase):
+    def setUp(self) -> None:
+        self.folder = TemporaryDirectory()
+        self.path = Path(self.folder.name) / 'updating'
+
+    def tearDown(self) -> None:
+        self.folder.cleanup()
+
+    def test_marked(self) -> None:
+        self.assertEqual(markers.active(self.path), [])
+        with override_settings(CURRENCY_UPDATING_FOLDER=self.path):
+            self.assertFalse(CurrencyConfig.updating())
+            with markers.marked(self.path):
+                self.assertEqual(markers.active(self.path), [os.getpid()])
+                self.assertTrue(CurrencyConfig.updating())
+            self.assertFalse(CurrencyConfig.updating())
+        self.assertEqual(list(self.path.iterdir()), [])
+
+    def test_dead_process_marker_removed(self) -> None:
+        finished = subprocess.run([sys.executable, '-c', 'import os; print(os.getpid())'],
+            capture_output=True, text=True, check=True)
+        pid = int(finished.stdout)
+        self.assertFalse(markers.pid_alive(pid))
+        self.path.mkdir()
+        (self.path / f'{pid}.pid').touch()
+        self.assertEqual(markers.active(self.path), [])
+        self.assertEqual(list(self.path.iterdir()), [])
+
+
+# Fresh interpreter: Django set up as web process does, then updater requested
+LAZY_UPDATER_SCRIPT = '''
+import json, sys
+import django
+django.setup()
+from currency.apps import CurrencyConfig
+modules = lambda: [name for name in sys.argv[1:] if name in sys.modules]
+before = modules()
+started = CurrencyConfig.updater is not None
+CurrencyConfig.get_updater()
+print(json.dumps({'before': before, 'started': started, 'after': modules()}))
+'''
+
+
+class LazyStartupTests(SimpleTestCase):
+    def test_web_process_cold_start(self) -> None:
+        result = scenarios.cold_start(1)
+        self.assertIs(result['lazy'], True)
+        self.assertEqual(result['scraper_modules_imported'], [])
+
+    def test_get_updater_imports_scraper(self) -> None:
+        environment = {
+            **os.environ,
+            'DJANGO_SETTINGS_MODULE': os.environ.get('DJANGO_SETTINGS_MODULE', 'currencys.settings'),
+            'CURRENCY_UPDATE_ON_START': '0',
+        }
+        process = subprocess.run(
+            [sys.executable, '-c', LAZY_UPDATER_SCRIPT, *scenarios.SCRAPER_MODULES],
+            cwd=settings.BASE_DIR, env=environment, capture_output=True, text=True, check=True
+        )
+        output = json.loads(process.stdout.splitlines()[-1])
+        self.assertEqual(output['before'], [])
+        self.assertFalse(output['started'])
+        self.assertIn('currency.parser', output['after'])
+        self.assertIn('requests', output['after'])
+
+    def test_ready_starts_updater_only_when_enabled(self) -> None:
+        config = apps.get_app_config('currency')
+        with mock.patch.object(CurrencyConfig, 'get_updater') as get_updater:
+            with override_settings(CURRENCY_UPDATE_ON_START=False):
+                config.ready()
+            get_updater.assert_not_called()
+            with override_settings(CURRENCY_UPDATE_ON_START=True):
+                config.ready()
+            get_updater.return_value.update.assert_called_once_with()
+
+
+@override_settings(CURRENCY_PROFILING=False, CURRENCY_PROFILING_HEADER=True)
+class ProfilingTests(TestCase):
+    def setUp(self) -> None:
+        currency = CurrencyInfo.objects.create(
+            number=1, number_url=10, code='AAA', name="A", country="A"
+        )
+        CurrencyRate.objects.bulk_create([
+            CurrencyRate(currencyInfo=currency, date=date(2020, 1, day), value=day / 10)
+            for day in range(1, 11)
+        ])
+        self.data = {
+            'fromDay': 1, 'fromMonth': 1, 'fromYear': 2020,
+            'toDay': 31, 'toMonth': 1, 'toYear': 2020,
+            'currencys': ['1'],
+        }
+        profiling.SAMPLES.clear()
+
+    def _timings(self, response: HttpResponse) -> dict[str, str]:
+        return {
+            entry.split(';')[0].strip(): entry
+            for entry in response['Server-Timing'].split(',')
+        }
+
+    def test_server_timing(self) -> None:
+        response = Client().post('/currency/fetch', self.data, headers={profiling.HEADER: '1'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()['info'][0]['y']), 10)
+        self.assertEqual(
+            list(self._timings(response)),
+            ['sql', 'sql-max', 'sql-fetch', 'build', 'serialize', 'python', 'total']
+        )
+        sample, = profiling.samples()
+        self.assertEqual(sample['path'], '/currency/fetch')
+        self.assertEqual(sample['status'], 200)
+        self.assertGreaterEqual(sample['queries'], 2)
+        self.assertEqual(sample['response_bytes'], len(response.content))
+
+    def test_not_profiled_without_header(self) -> None:
+        response = Client().post('/currency/fetch', self.data)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('Server-Timing', response)
+        self.assertEqual(profiling.samples(), [])
+        with override_settings(CURRENCY_PROFILING_HEADER=False):
+            response = Client().post('/currency/fetch', self.data, headers={profiling.HEADER: '1'})
+        self.assertNotIn('Server-Timing', response)
+
+    def test_samples_limit(self) -> None:
+        with override_settings(CURRENCY_PROFILING_SAMPLES=3):
+            client = Client()
+            for day in range(1, 6):
+                client.post('/currency/fetch', {**self.data, 'toDay': day}, headers={profiling.HEADER: '1'})
+        self.assertEqual(len(profiling.samples()), 3)
+        self.assertEqual(profiling.SAMPLES.maxlen, 3)
+        # Newest samples are kept when setting changes back
+        Client().post('/currency/fetch', self.data)
+        self.assertEqual(len(profiling.samples()), 3)
+        self.assertEqual(profiling.SAMPLES.maxlen, settings.CURRENCY_PROFILING_SAMPLES)
+
+    def test_samples_view(self) -> None:
+        with override_settings(DEBUG=False, CURRENCY_PROFILING=False):
+            self.assertEqual(Client().get('/currency/profiling').status_code, 404)
+        with override_settings(DEBUG=False, CURRENCY_PROFILING=True):
+            Client().post('/currency/fetch', self.data)
+            response = Client().get('/currency/profiling')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['samples'][0]['path'], '/currency/fetch')
+
+    def test_python_time(self) -> None:
+        """ Python time excludes SQL and stages, SQL inside stages isn't subtracted twice """
+        now = [0.]
+        def advance(seconds: float) -> None:
+            now[0] += seconds
+        def slow_execute(execute, sql, params, many, context):
+            advance(2. if 'LIMIT' in sql else 4.)
+            return execute(sql, params, many, context)
+
+        def view(request: HttpRequest) -> HttpResponse:
+            advance(1.)
+            with connection.execute_wrapper(slow_execute):
+                with profiling.stage(request, 'sql-fetch'):
+                    CurrencyRate.objects.first()
+                    advance(.5)
+                CurrencyRate.objects.count()
+            with profiling.stage(request, 'build'):
+                advance(3.)
+            return HttpResponse()
+
+        with mock.patch.object(profiling, 'perf_counter', lambda: now[0]), \
+                override_settings(CURRENCY_PROFILING=True):
+            profiling.ProfilingMiddleware(view)(RequestFactory().get('/'))
+        sample, = profiling.samples()
+        self.assertEqual(sample['queries'], 2)
+        self.assertEqual(sample['sql_total_ms'], 6000.)
+        self.assertEqual(sample['stages_ms'], {'sql-fetch': 2500., 'build': 3000.})
+        self.assertEqual(sample['total_ms'], 10500.)
+        self.assertEqual(sample['python_ms'], 1000.)
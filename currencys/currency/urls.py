@@ -8,4 +8,6 @@ app_name = CurrencyConfig.name
 urlpatterns = [
     path('', views.index, name='index'),
     path('fetch', views.info_fetch, name='fetch'),
+    path('metrics', views.metrics_text, name='metrics'),
+    path('profiling', views.profiling_samples, name='profiling'),
 ]
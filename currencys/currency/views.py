@@ -1,10 +1,12 @@
 from datetime import date
 
+from django.conf import settings
 from django.shortcuts import render
-from django.http.response import JsonResponse
+from django.http import Http404
+from django.http.response import HttpResponse, JsonResponse
 
 
-from . import forms
+from . import forms, metrics, profiling
 from .models import CurrencyInfo, CurrencyRate
 from .apps import CurrencyConfig
 
@@ -32,21 +34,27 @@ def info_fetch(request):
         output.append(currency_dict)
         currency_dict['x'] = x = []
         currency_dict['y'] = y = []
-        iterator = CurrencyRate\
-            .objects\
-            .filter(
-                date__range=[from_date, to_date],
-                currencyInfo=currency_info
-            )\
-            .values('date', 'value')\
-            .iterator()
-        for rate in iterator:
-            assert isinstance(rate['date'], date)
-            x.append(rate['date'].ctime())
-            y.append(rate['value'])
+        # Rows are fetched before building x/y, so profiling tells these stages apart
+        # (on SQLite most of query time is spent fetching, not in cursor.execute())
+        with profiling.stage(request, 'sql-fetch'):
+            rates = list(CurrencyRate
+                .objects
+                .filter(
+                    date__range=[from_date, to_date],
+                    currencyInfo=currency_info
+                )
+                .values_list('date', 'value')
+            )
+        with profiling.stage(request, 'build'):
+            for rate_date, value in rates:
+                assert isinstance(rate_date, date)
+                x.append(rate_date.ctime())
+                y.append(value)
         currency_dict['name'] = currency_info.name
         currency_dict['type'] = 'line'
-    return JsonResponse(data={'info': output})
+    with profiling.stage(request, 'serialize'):
+        response = JsonResponse(data={'info': output})
+    return response
 
 
 def index(request, status: int | None = None):
@@ -57,11 +65,24 @@ def index(request, status: int | None = None):
         form = forms.DatesForm()
         post = False
     currencys = CurrencyInfo.objects.values('number', 'name').order_by('name').all()
-    assert CurrencyConfig.updater is not None
     return render(request, 'currency/index.html', context={
         'form': form,
         'post': post,
         'currencys': currencys,
-        'updating': CurrencyConfig.updater.updating
+        'updating': CurrencyConfig.updating()
     }, status=status)
 
+
+def metrics_text(request):
+    # Updater usually runs in other processes (update_rates, backfill workers),
+    # which publish their metrics to CURRENCY_METRICS_FOLDER
+    return HttpResponse(
+        metrics.collect(settings.CURRENCY_METRICS_FOLDER, source='web'),
+        content_type='text/plain; version=0.0.4; charset=utf-8'
+    )
+
+
+def profiling_samples(request):
+    if not (settings.DEBUG or getattr(settings, 'CURRENCY_PROFILING', False)):
+        raise Http404()
+    return JsonResponse(data={'samples': profiling.samples()})
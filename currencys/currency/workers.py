@@ -0,0 +1,20 @@
+"""
+Entry points of worker processes
+
+Spawned process imports target by name before Django is set up, so this
+module must not import models (directly or through other app modules)
+"""
+import os
+
+__all__ = ('backfill_worker', )
+
+
+def backfill_worker(*args) -> None:
+    """ Sets up Django in spawned process and runs backfill._work(*args) """
+    # Workers never run background updater, whatever parent environment says
+    os.environ['CURRENCY_UPDATE_ON_START'] = '0'
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'currencys.settings')
+    import django
+    django.setup()
+    from .backfill import _work
+    _work(*args)
@@ -42,6 +42,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    "currency.profiling.ProfilingMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
@@ -51,6 +52,18 @@ MIDDLEWARE = [
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
 ]
 
+# Start database updater (and import scraping stack) in background on process start.
+# Off by default: web workers and management commands start faster,
+# update is run by `manage.py update_rates` or by single process with this flag
+CURRENCY_UPDATE_ON_START = getenv('CURRENCY_UPDATE_ON_START', '0') == '1'
+
+# Request profiling (Server-Timing header, samples at /currency/profiling)
+# CURRENCY_PROFILING profiles every request,
+# CURRENCY_PROFILING_HEADER profiles requests with X-Profile header only
+CURRENCY_PROFILING = False
+CURRENCY_PROFILING_HEADER = DEBUG
+CURRENCY_PROFILING_SAMPLES = 500
+
 ROOT_URLCONF = "currencys.urls"
 
 TEMPLATES = [
@@ -84,6 +97,10 @@ DATABASES = {
 
 LOGGING_FOLDER = BASE_DIR / 'logging'
 LOGGING_FOLDER.mkdir(exist_ok=True)
+# Metrics of update_rates and backfill workers, served by /currency/metrics with web process ones
+CURRENCY_METRICS_FOLDER = LOGGING_FOLDER / 'metrics'
+# Markers of processes updating database, shown by web processes as updating warning
+CURRENCY_UPDATING_FOLDER = LOGGING_FOLDER / 'updating'
 LOGGING = {
     "version": 1,
     "disable_existing_loggers": False,